@@ -1,11 +1,25 @@
 import streamlit as st
 import pandas as pd
 import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
 import numpy as np
 import plotly.express as px
 from prophet import Prophet
 from prophet.plot import plot_plotly
 import plotly.graph_objects as go
+from openpyxl import load_workbook
+
+# Copy-on-write: recortes e projeções (df[mask], df[colunas], head) compartilham
+# memória com a base até serem alterados, então os relatórios não precisam de
+# .copy() defensivo para não contaminar as bases em cache.
+pd.set_option("mode.copy_on_write", True)
 
 
 # Configurar a página para sempre ser exibida em widescreen
@@ -17,33 +31,120 @@ st.set_page_config(
 
 # --- FUNÇÕES EXISTENTES (Com pequenas adaptações) ---
 
-def carregar_planilha_metas(caminho_arquivo, aba=0):
-    df = pd.read_excel(caminho_arquivo, sheet_name=aba)
-    df.rename(columns={df.columns[0]: "Categoria"}, inplace=True)
-    return df
+MESES_ABREV = ["jan", "fev", "mar", "abr", "mai", "jun", "jul", "ago", "set", "out", "nov", "dez"]
+
+
+def carregar_matriz_metas(caminho_arquivo):
+    """
+    Lê todas as abas da planilha de metas de uma só vez e monta uma matriz
+    indexada por (aba, categoria, mês).
+
+    Retorna um dicionário com:
+    - "valores": array NumPy (n_abas, n_categorias, 12), NaN onde não há meta.
+    - "presentes": array booleano (n_abas, n_categorias), se a aba tem a linha
+      da categoria (o índice de categorias é comum a todas as abas).
+    - "indice_aba" / "indice_categoria": posição de cada aba/categoria no array.
+    - "abas_vazias": abas sem nenhuma meta numérica.
+    """
+    planilhas = pd.read_excel(caminho_arquivo, sheet_name=None)
+
+    indice_aba = {aba: i for i, aba in enumerate(planilhas)}
+    indice_categoria = {}
+    for df in planilhas.values():
+        if df.empty:
+            continue
+        for categoria in df.iloc[:, 0].dropna():
+            indice_categoria.setdefault(categoria, len(indice_categoria))
+
+    valores = np.full((len(indice_aba), len(indice_categoria), 12), np.nan)
+    presentes = np.zeros((len(indice_aba), len(indice_categoria)), dtype=bool)
+    for aba, df in planilhas.items():
+        if df.empty:
+            continue
+        colunas_mes = [m for m in MESES_ABREV if m in df.columns]
+        numeros = df[colunas_mes].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+        posicoes_mes = [MESES_ABREV.index(m) for m in colunas_mes]
+        vistas = set()
+        for linha, categoria in enumerate(df.iloc[:, 0]):
+            # Assim como o .loc[...].values[0] original, vale a primeira ocorrência
+            if pd.isna(categoria) or categoria in vistas:
+                continue
+            vistas.add(categoria)
+            valores[indice_aba[aba], indice_categoria[categoria], posicoes_mes] = numeros[linha]
+            presentes[indice_aba[aba], indice_categoria[categoria]] = True
+
+    abas_vazias = {aba for aba, i in indice_aba.items() if np.isnan(valores[i]).all()}
+    return {
+        "valores": valores,
+        "presentes": presentes,
+        "indice_aba": indice_aba,
+        "indice_categoria": indice_categoria,
+        "abas_vazias": abas_vazias,
+    }
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _carregar_matriz_metas_memoria(caminho_arquivo, mtime, tamanho):
+    return carregar_matriz_metas(caminho_arquivo)
 
-def gerar_analise_abc_clientes(df_vendas, com_cdp=True, nomes_cdp=None):
+
+def obter_matriz_metas(caminho_arquivo):
+    """
+    Matriz de metas em memória, relida apenas quando o arquivo de metas muda.
+    """
+    return _carregar_matriz_metas_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
+
+
+def buscar_meta(matriz_metas, aba, categoria, mes_referencia):
+    """
+    Consulta O(1) de uma meta. Lança KeyError se a aba não existir ou não tiver
+    a linha da categoria.
+    """
+    i_aba = matriz_metas["indice_aba"][aba]
+    i_categoria = matriz_metas["indice_categoria"][categoria]
+    if not matriz_metas["presentes"][i_aba, i_categoria]:
+        raise KeyError(f"{categoria!r} não existe na aba {aba!r}")
+    return float(matriz_metas["valores"][i_aba, i_categoria, mes_referencia - 1])
+
+
+# Aba da planilha de metas de cada vendedor. Os nomes devem ser os EXATOS e
+# LIMPOS do ERP, em MAIÚSCULAS; "Todos" e vendedores fora da lista usam a aba GERAL.
+ABA_META_GERAL = "GERAL"
+ABAS_META_VENDEDOR = {
+    "ROSESILVESTRE": "ROSE",
+    "PAOLA": "PAOLA",
+    "JEMINE OLIVEIRA": "JEMINE",
+    "DANILIMA": "DANILIMA",
+    "JOSE RENATO MAULER": "RENATO",
+}
+
+
+def aba_meta_do_vendedor(vendedor):
+    if vendedor == "Todos":  # "Todos" é um valor especial, não precisa de .upper()
+        return ABA_META_GERAL
+    return ABAS_META_VENDEDOR.get(vendedor.upper(), ABA_META_GERAL)
+
+def gerar_analise_abc_clientes(df_vendas, com_cdp=True):
     """
     Calcula a Curva ABC de clientes com base no valor total de vendas.
     
     Parâmetros:
-    - df_vendas: DataFrame com vendas.
+    - df_vendas: DataFrame com vendas (da base normalizada, com a coluna CDP).
     - com_cdp: Booleano, se True inclui vendas da Casa do Pedreiro.
-    - nomes_cdp: lista com os nomes dos clientes da Casa do Pedreiro para filtro.
     """
 
     if df_vendas is None or df_vendas.empty:
         return None
     
-    # Aplicar filtro para Casa do Pedreiro, se necessário
-    if not com_cdp and nomes_cdp is not None:
-        df_vendas = df_vendas[~df_vendas["CLI_RAZ"].isin(nomes_cdp)]
+    # Aplicar filtro para Casa do Pedreiro, se necessário (coluna CDP pré-calculada)
+    if not com_cdp:
+        df_vendas = df_vendas[~df_vendas["CDP"]]
         if df_vendas.empty:
             # Opcional: aqui pode emitir um aviso, mas isso depende do contexto de uso
             print("⚠️ Nenhuma venda encontrada após filtro 'Casa do Pedreiro'.")
 
     # Agrupar vendas por cliente
-    vendas_por_cliente = df_vendas.groupby('CLI_RAZ')['PED_TOTAL'].sum().sort_values(ascending=False).reset_index()
+    vendas_por_cliente = df_vendas.groupby('CLI_RAZ', observed=True)['PED_TOTAL'].sum().sort_values(ascending=False).reset_index()
     vendas_por_cliente.rename(columns={'PED_TOTAL': 'Valor Total Vendas'}, inplace=True)
     
     # Calcular porcentagem de participação e acumulada
@@ -69,15 +170,15 @@ def preparar_dados_fluxo_caixa(df_receber, df_pagar, saldo_inicial, data_inicio_
     Consolida e calcula o fluxo de caixa PREVISTO e REALIZADO.
     """
     # --- FLUXO PREVISTO (baseado em Data Vencimento de contas EM ABERTO) ---
-    receber_previsto = df_receber[df_receber['Status'] == 'EM ABERTO'].copy()
-    pagar_previsto = df_pagar[df_pagar['Status'] == 'EM ABERTO'].copy()
+    receber_previsto = df_receber[df_receber['Status'] == 'EM ABERTO']
+    pagar_previsto = df_pagar[df_pagar['Status'] == 'EM ABERTO']
     entradas_prev = receber_previsto.groupby('Data Vencimento')['Valor'].sum().rename('Entradas_Previstas')
     saidas_prev = pagar_previsto.groupby('Data Vencimento')['Valor'].sum().rename('Saídas_Previstas')
     fluxo_prev_df = pd.concat([entradas_prev, saidas_prev], axis=1)
 
     # --- FLUXO REALIZADO (baseado em Data Baixa de contas PAGAS) ---
-    receber_real = df_receber[df_receber['Status'] == 'PAGO'].copy()
-    pagar_real = df_pagar[df_pagar['Status'] == 'PAGO'].copy()
+    receber_real = df_receber[df_receber['Status'] == 'PAGO']
+    pagar_real = df_pagar[df_pagar['Status'] == 'PAGO']
     entradas_real = receber_real.groupby('Data_Baixa')['Valor'].sum().rename('Entradas_Realizadas')
     saidas_real = pagar_real.groupby('Data_Baixa')['VALOR_PAGO'].sum().rename('Saídas_Realizadas')
     fluxo_real_df = pd.concat([entradas_real, saidas_real], axis=1)
@@ -112,7 +213,6 @@ def criar_painel_financeiro_avancado(
     import streamlit as st
     import plotly.express as px
     import datetime
-    import numpy as np
 
     # Bloco do Título
     st.markdown(f"""
@@ -130,19 +230,17 @@ def criar_painel_financeiro_avancado(
 
     # --- 1. CÁLCULOS DOS VALORES BASE ---
     valor_pago = df_filtrado[df_filtrado[coluna_status] == 'PAGO'][coluna_valor].sum()
-    df_em_aberto_original = df_filtrado[df_filtrado[coluna_status] == 'EM ABERTO'].copy()
+    df_em_aberto_original = df_filtrado[df_filtrado[coluna_status] == 'EM ABERTO']
     valor_em_aberto_total = df_em_aberto_original[coluna_valor].sum()
 
     # --- 2. LÓGICA UNIFICADA PARA CALCULAR ATRASADOS E A VENCER ---
     hoje = pd.to_datetime(datetime.date.today())
     
-    # Criar status dinâmico para análise em todas as contas em aberto
-    df_em_aberto_original['Status_Detalhado'] = np.where(
-        df_em_aberto_original[coluna_vencimento] < hoje, 'Atrasado', 'A Vencer'
-    )
+    # Status dinâmico das contas em aberto, como máscara (sem coluna auxiliar)
+    atrasado = (df_em_aberto_original[coluna_vencimento] < hoje).to_numpy()
     
-    valor_atrasado = df_em_aberto_original[df_em_aberto_original['Status_Detalhado'] == 'Atrasado'][coluna_valor].sum()
-    valor_a_vencer = df_em_aberto_original[df_em_aberto_original['Status_Detalhado'] == 'A Vencer'][coluna_valor].sum()
+    valor_atrasado = df_em_aberto_original[coluna_valor][atrasado].sum()
+    valor_a_vencer = df_em_aberto_original[coluna_valor][~atrasado].sum()
 
     # --- 3. CUSTOMIZAÇÃO DOS TEXTOS DOS KPIs ---
     if 'Receber' in titulo:
@@ -218,8 +316,6 @@ def criar_painel_financeiro_avancado(
     # Adicionar detalhamento para Contas a Pagar
     if 'Pagar' in titulo:
         with st.expander("Ver detalhamento completo de Contas a Pagar"):
-            df_filtrado = df_filtrado.copy()  # ou df_pagar.copy() se for esse o nome certo
-
             # --- Filtro por status ---
             status_opcoes = df_filtrado["Status"].dropna().unique().tolist()
             status_escolhido = st.multiselect("Filtrar por status", status_opcoes, default=status_opcoes)
@@ -251,7 +347,7 @@ def criar_painel_financeiro_avancado(
         st.markdown("---")
         st.markdown(f"##### 🚨 Análise de Inadimplência")
         
-        df_inadimplentes = df_filtrado[df_filtrado[coluna_inadimplencia] == 'Inadimplente'].copy()
+        df_inadimplentes = df_filtrado[df_filtrado[coluna_inadimplencia] == 'Inadimplente']
         
         if not df_inadimplentes.empty:
             
@@ -302,7 +398,7 @@ def criar_painel_financeiro_avancado(
                     'Data Emissao'
                 ]
 
-                df_inad = df_inadimplentes[colunas_exibir].copy()
+                df_inad = df_inadimplentes[colunas_exibir]
 
                 # --- Filtro por cliente ---
                 clientes = df_inad[coluna_entidade].dropna().unique().tolist()
@@ -325,37 +421,49 @@ def criar_painel_financeiro_avancado(
 
         else:
             st.success("✅ Ótima notícia! Não há clientes inadimplentes no período selecionado.")
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _carregar_dados_financeiros_memoria(caminho_arquivo, mtime, tamanho):
+    """
+    Lê as abas 'Receber' e 'Pagar' numa só abertura da planilha, uma única vez
+    por versão do arquivo.
+
+    Os DataFrames retornados são compartilhados entre abas, reruns e sessões:
+    quem precisar alterar algo deve trabalhar sobre um recorte ou uma cópia.
+    """
+    abas = pd.read_excel(caminho_arquivo, sheet_name=["Receber", "Pagar"])
+    df_receber, df_pagar = abas["Receber"], abas["Pagar"]
+
+    # --- Padroniza as colunas de 'Contas a Receber' ---
+    df_receber['Data Emissao'] = pd.to_datetime(df_receber['Data Emissao'], errors='coerce')
+    df_receber['Data Vencimento'] = pd.to_datetime(df_receber['Data Vencimento'], errors='coerce')
+    df_receber['Data_Baixa'] = pd.to_datetime(df_receber.get('Data_Baixa'), errors='coerce') # Lendo Data_Baixa
+    df_receber['Valor'] = pd.to_numeric(df_receber['Valor'], errors='coerce').fillna(0)
+    df_receber['Cliente'] = df_receber['Cliente'].str.strip()
+    df_receber['Status'] = df_receber['Status'].str.strip()
+
+    if 'Inadimplência' in df_receber.columns:
+        df_receber['Inadimplência'] = df_receber['Inadimplência'].str.strip().fillna("N/A")
+    else:
+        df_receber['Inadimplência'] = "N/A"
+        st.warning("Atenção: A coluna 'Inadimplência' não foi encontrada na aba 'Receber'.")
+
+    # --- Padroniza as colunas de 'Contas a Pagar' ---
+    df_pagar['Data Emissao'] = pd.to_datetime(df_pagar['Data Emissao'], errors='coerce')
+    df_pagar['Data Vencimento'] = pd.to_datetime(df_pagar['Data Vencimento'], errors='coerce')
+    df_pagar['Data_Baixa'] = pd.to_datetime(df_pagar.get('Data_Baixa'), errors='coerce') # Lendo Data_Baixa
+    df_pagar['Valor'] = pd.to_numeric(df_pagar['Valor'], errors='coerce').fillna(0)
+    df_pagar['Fornecedor'] = df_pagar['Fornecedor'].str.strip()
+    df_pagar['Status'] = df_pagar['Status'].str.strip()
+
+    return df_receber, df_pagar
+
+
 def carregar_dados_financeiros(caminho_arquivo):
     """
     Carrega as abas 'Receber' e 'Pagar', incluindo 'Inadimplência' e 'Data_Baixa'.
     """
     try:
-        df_receber = pd.read_excel(caminho_arquivo, sheet_name="Receber")
-        df_pagar = pd.read_excel(caminho_arquivo, sheet_name="Pagar")
-
-        # --- Padroniza as colunas de 'Contas a Receber' ---
-        df_receber['Data Emissao'] = pd.to_datetime(df_receber['Data Emissao'], errors='coerce')
-        df_receber['Data Vencimento'] = pd.to_datetime(df_receber['Data Vencimento'], errors='coerce')
-        df_receber['Data_Baixa'] = pd.to_datetime(df_receber.get('Data_Baixa'), errors='coerce') # Lendo Data_Baixa
-        df_receber['Valor'] = pd.to_numeric(df_receber['Valor'], errors='coerce').fillna(0)
-        df_receber['Cliente'] = df_receber['Cliente'].str.strip()
-        df_receber['Status'] = df_receber['Status'].str.strip()
-        
-        if 'Inadimplência' in df_receber.columns:
-            df_receber['Inadimplência'] = df_receber['Inadimplência'].str.strip().fillna("N/A")
-        else:
-            df_receber['Inadimplência'] = "N/A"
-            st.warning("Atenção: A coluna 'Inadimplência' não foi encontrada na aba 'Receber'.")
-
-        # --- Padroniza as colunas de 'Contas a Pagar' ---
-        df_pagar['Data Emissao'] = pd.to_datetime(df_pagar['Data Emissao'], errors='coerce')
-        df_pagar['Data Vencimento'] = pd.to_datetime(df_pagar['Data Vencimento'], errors='coerce')
-        df_pagar['Data_Baixa'] = pd.to_datetime(df_pagar.get('Data_Baixa'), errors='coerce') # Lendo Data_Baixa
-        df_pagar['Valor'] = pd.to_numeric(df_pagar['Valor'], errors='coerce').fillna(0)
-        df_pagar['Fornecedor'] = df_pagar['Fornecedor'].str.strip()
-        df_pagar['Status'] = df_pagar['Status'].str.strip()
-
-        return df_receber, df_pagar
+        return _carregar_dados_financeiros_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
 
     except FileNotFoundError:
         st.error(f"❌ Erro: Arquivo Financeiro '{caminho_arquivo}' não encontrado.")
@@ -364,116 +472,1240 @@ def carregar_dados_financeiros(caminho_arquivo):
         st.error(f"❌ Erro ao ler o arquivo financeiro: {e}")
         return None, None
 
-def carregar_feriados():
-    try:
-        df = pd.read_excel("resources/FERIADOS.xlsx", header=None)
-        df.columns = ['Data']
-        df['Data'] = pd.to_datetime(df['Data'], dayfirst=True, errors='coerce')
-        feriados = df['Data'].dt.date.tolist()
-        return feriados
-    except FileNotFoundError:
-        st.warning("⚠️ Arquivo 'FERIADOS.xlsx' não encontrado. Dias úteis serão calculados sem feriados.")
-        return []
+# --- REGISTRO DE FERIADOS ---
+
+# Camadas de feriados que valem para o calendário de dias úteis: a nacional é
+# obrigatória; a regional e a municipal só entram se a planilha existir. Outras
+# camadas podem ser somadas pela variável de ambiente CRM_FERIADOS_EXTRAS
+# (caminhos de planilhas separados por ";"). Cada planilha tem as datas na
+# primeira coluna, sem cabeçalho, e pode cobrir quantos anos for preciso.
+CAMADAS_FERIADOS = {
+    "nacional": "resources/FERIADOS.xlsx",
+    "regional": "resources/FERIADOS_REGIONAIS.xlsx",
+    "municipal": "resources/FERIADOS_MUNICIPAIS.xlsx",
+}
+CAMADAS_FERIADOS.update({
+    os.path.splitext(os.path.basename(caminho))[0].lower(): caminho
+    for caminho in (c.strip() for c in os.environ.get("CRM_FERIADOS_EXTRAS", "").split(";"))
+    if caminho
+})
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _ler_camada_feriados(caminho_arquivo, mtime, tamanho):
+    datas = pd.to_datetime(pd.read_excel(caminho_arquivo, header=None).iloc[:, 0], dayfirst=True, errors="coerce")
+    return np.unique(datas.dropna().to_numpy().astype("datetime64[D]"))
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _montar_registro_feriados(versoes_camadas):
+    camadas = {
+        nome: _ler_camada_feriados(caminho, mtime, tamanho)
+        for nome, caminho, mtime, tamanho in versoes_camadas
+    }
+    dias = np.unique(np.concatenate([np.array([], dtype="datetime64[D]"), *camadas.values()]))
+    return {
+        "dias": dias,
+        "camadas": camadas,
+        "calendario": np.busdaycalendar(weekmask="1111100", holidays=dias),
+    }
+
+
+def carregar_feriados():
+    """
+    Registro de feriados de todas as camadas, lido uma vez por versão das
+    planilhas e compartilhado pelo processo. Contém:
+    - "dias": array datetime64[D] ordenado e sem repetições;
+    - "camadas": dias de cada camada (nacional, regional, municipal...);
+    - "calendario": np.busdaycalendar pronto para as contas de dias úteis.
+    """
+    versoes = []
+    for nome, caminho in CAMADAS_FERIADOS.items():
+        try:
+            versoes.append((nome, caminho, *impressao_digital(caminho)))
+        except FileNotFoundError:
+            if nome == "nacional":
+                st.warning("⚠️ Arquivo 'FERIADOS.xlsx' não encontrado. Dias úteis serão calculados sem feriados.")
+    return _montar_registro_feriados(tuple(versoes))
+
+
+# --- CACHE COLUNAR DA BASE DE VENDAS ---
+
+PASTA_CACHE = ".cache"
+VERSAO_CACHE = 6
+MAX_ANOS_EM_MEMORIA = 6  # bases anuais normalizadas mantidas em memória (somando versões do arquivo)
+
+# Colunas da exportação do ERP efetivamente usadas pelo painel
+COLUNAS_VENDAS = ["DAT_CAD", "VEN_NOME", "CLI_RAZ", "PED_OBS_INT", "PED_STATUS", "PED_TIPO", "PED_TOTAL"]
+# Tipos das colunas numéricas/data; as demais ficam como object
+TIPOS_COLUNAS_VENDAS = {"DAT_CAD": "datetime64[ns]", "PED_TOTAL": np.float64}
+
+
+def impressao_digital(caminho_arquivo):
+    """
+    Retorna (mtime, tamanho) do arquivo, usados como chave dos caches em memória.
+    Lança FileNotFoundError se o arquivo não existir.
+    """
+    stat = os.stat(caminho_arquivo)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def calcular_hash_arquivo(caminho_arquivo, tamanho_bloco=1024 * 1024):
+    """
+    Calcula o hash SHA-256 do conteúdo de um arquivo, lendo em blocos.
+    """
+    sha = hashlib.sha256()
+    with open(caminho_arquivo, "rb") as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def _ler_metadados_cache(caminho_meta):
+    try:
+        with open(caminho_meta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def obter_trava_cache_vendas():
+    """
+    Trava única por processo para o cache em disco: sessões concorrentes e o
+    monitor de arquivos não sincronizam, ingerem nem regravam partições, cubo e
+    metadados ao mesmo tempo. Reentrante, pois o cubo sincroniza a base antes.
+    """
+    return threading.RLock()
+
+
+@st.cache_resource(show_spinner=False)
+def obter_falhas_cache_vendas():
+    """
+    Versões da planilha, (caminho, mtime, tamanho), cujo cache não pôde ser
+    gravado: não adianta refazer hash e leitura a cada chamada, a base segue
+    direto pela leitura em memória até o arquivo mudar.
+    """
+    return set()
+
+
+def _caminho_temporario(caminho):
+    # Nome exclusivo por processo e thread: gravações simultâneas não disputam o mesmo .tmp
+    return f"{caminho}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def _gravar_metadados_cache(caminho_meta, metadados):
+    caminho_tmp = _caminho_temporario(caminho_meta)
+    with open(caminho_tmp, "w", encoding="utf-8") as f:
+        json.dump(metadados, f)
+    os.replace(caminho_tmp, caminho_meta)
+
+
+# Formatos aceitos para DAT_CAD quando a célula vem como texto (na ordem de tentativa)
+FORMATOS_DAT_CAD = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y")
+
+
+def _converter_data(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor
+    if isinstance(valor, datetime.date):
+        return datetime.datetime(valor.year, valor.month, valor.day)
+    if not isinstance(valor, str):
+        return None
+    texto = valor.strip()
+    for formato in FORMATOS_DAT_CAD:
+        try:
+            return datetime.datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    return None
+
+
+def _converter_numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _converter_texto(valor):
+    # Células numéricas/data em colunas de texto viram str: coluna mista quebra o Parquet
+    if valor is None or valor == "":
+        return np.nan
+    return valor if isinstance(valor, str) else str(valor)
+
+
+CONVERSORES_VENDAS = {
+    "DAT_CAD": _converter_data,
+    "PED_TOTAL": _converter_numero,
+}
+
+
+def _ler_vendas_excel(caminho_arquivo, colunas=None, linhas_ja_ingeridas=0):
+    """
+    Lê a primeira aba da planilha de vendas em modo streaming (openpyxl read-only),
+    mantendo apenas as colunas usadas pelo painel.
+
+    Os tipos são convertidos linha a linha e as colunas são montadas direto em
+    arrays NumPy, sem materializar as colunas que não interessam. As primeiras
+    `linhas_ja_ingeridas` linhas não são convertidas, apenas entram na assinatura
+    (hash dos valores brutos), usada para detectar alterações no histórico.
+
+    Retorna (df_linhas_novas, info), onde info traz o total de linhas, a assinatura
+    de todas as linhas e a assinatura das `linhas_ja_ingeridas` primeiras (ou None
+    se a planilha tiver menos linhas que isso).
+    """
+    colunas = colunas or COLUNAS_VENDAS
+    wb = load_workbook(caminho_arquivo, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, ())
+        posicoes = {nome: i for i, nome in enumerate(cabecalho) if nome in colunas}
+        conversores = {
+            nome: CONVERSORES_VENDAS.get(nome, _converter_texto) for nome in posicoes
+        }
+        valores = {nome: [] for nome in posicoes}
+
+        assinatura = hashlib.sha256(repr(tuple(posicoes)).encode("utf-8"))
+        assinatura_prefixo = assinatura.hexdigest() if linhas_ja_ingeridas == 0 else None
+        total_linhas = 0
+
+        for linha in linhas:
+            if not any(v is not None for v in linha):
+                continue
+            brutos = tuple(linha[i] if i < len(linha) else None for i in posicoes.values())
+            assinatura.update(repr(brutos).encode("utf-8"))
+            total_linhas += 1
+            if total_linhas == linhas_ja_ingeridas:
+                assinatura_prefixo = assinatura.hexdigest()
+            if total_linhas <= linhas_ja_ingeridas:
+                continue
+            for nome, valor in zip(posicoes, brutos):
+                valores[nome].append(conversores[nome](valor))
+    finally:
+        wb.close()
+
+    dados = {}
+    for nome in colunas:
+        if nome not in valores:
+            continue
+        dados[nome] = np.array(valores[nome], dtype=TIPOS_COLUNAS_VENDAS.get(nome, object))
+
+    info = {
+        "linhas": total_linhas,
+        "assinatura": assinatura.hexdigest(),
+        "assinatura_prefixo": assinatura_prefixo,
+    }
+    return pd.DataFrame(dados), info
+
+
+def _base_vendas_vazia(colunas=None):
+    return pd.DataFrame({
+        nome: np.array([], dtype=TIPOS_COLUNAS_VENDAS.get(nome, object)) for nome in colunas or COLUNAS_VENDAS
+    })
+
+
+def _caminhos_cache(caminho_arquivo):
+    """(pasta das partições, arquivo de metadados) do cache de um arquivo de vendas."""
+    nome_base = os.path.splitext(os.path.basename(caminho_arquivo))[0]
+    return os.path.join(PASTA_CACHE, nome_base), os.path.join(PASTA_CACHE, f"{nome_base}.json")
+
+
+def _nome_particao(ano, mes):
+    return "sem-data.parquet" if ano is None else f"{ano:04d}-{mes:02d}.parquet"
+
+
+def _ano_da_particao(nome_particao):
+    """Ano de uma partição (None para a partição dos pedidos sem DAT_CAD)."""
+    return None if nome_particao.startswith("sem-data") else int(nome_particao[:4])
+
+
+def _ler_partes_cache(pasta_partes, partes, colunas=None):
+    frames = [pd.read_parquet(os.path.join(pasta_partes, parte), columns=colunas) for parte in partes]
+    if not frames:
+        return _base_vendas_vazia(colunas)
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames)
+
+
+def _gravar_particoes(pasta_partes, df, partes_existentes=()):
+    """
+    Distribui os pedidos de df pelas partições ano-mês de DAT_CAD (AAAA-MM.parquet,
+    mais sem-data.parquet para DAT_CAD vazia). Partições já existentes recebem os
+    pedidos no final; só as partições tocadas são regravadas. O índice (número
+    da linha na planilha) é gravado sempre como coluna, para que motores que
+    leem o Parquet diretamente (duckdb) também o encontrem. Retorna a lista
+    ordenada de partições.
+    """
+    os.makedirs(pasta_partes, exist_ok=True)
+    partes = set(partes_existentes)
+    datas = df["DAT_CAD"]
+    for (ano, mes), grupo in df.groupby([datas.dt.year, datas.dt.month], dropna=False, sort=True):
+        nome_parte = _nome_particao(None if pd.isna(ano) else int(ano), None if pd.isna(mes) else int(mes))
+        caminho_parte = os.path.join(pasta_partes, nome_parte)
+        if nome_parte in partes:
+            grupo = pd.concat([pd.read_parquet(caminho_parte), grupo])
+        caminho_tmp = _caminho_temporario(caminho_parte)
+        grupo.to_parquet(caminho_tmp, index=True)
+        os.replace(caminho_tmp, caminho_parte)
+        partes.add(nome_parte)
+    return sorted(partes)
+
+
+def _trocar_pasta(pasta_nova, pasta_partes):
+    """
+    Põe pasta_nova no lugar de pasta_partes com duas renomeações: sessões que
+    já abriram partições antigas terminam a leitura, as próximas leem as novas.
+    """
+    pasta_antiga = _caminho_temporario(pasta_partes) + ".antiga"
+    if os.path.isdir(pasta_partes):
+        os.replace(pasta_partes, pasta_antiga)
+    os.replace(pasta_nova, pasta_partes)
+    shutil.rmtree(pasta_antiga, ignore_errors=True)
+
+
+def _reconstruir_cache_vendas(caminho_arquivo, pasta_partes, caminho_meta, metadados_novos):
+    df, info = _ler_vendas_excel(caminho_arquivo)
+    # Partições montadas numa pasta nova, sem apagar as que outras sessões estão lendo
+    pasta_nova = _caminho_temporario(pasta_partes)
+    try:
+        metadados_novos.update(
+            linhas=info["linhas"],
+            assinatura=info["assinatura"],
+            colunas=list(df.columns),
+            partes=_gravar_particoes(pasta_nova, df),
+        )
+        _trocar_pasta(pasta_nova, pasta_partes)
+        _gravar_metadados_cache(caminho_meta, metadados_novos)
+    except Exception as e:
+        # Sem pyarrow ou sem permissão de escrita: segue sem cache
+        shutil.rmtree(pasta_nova, ignore_errors=True)
+        print(f"⚠️ Não foi possível gravar o cache de vendas: {e}")
+        return None
+    return metadados_novos
+
+
+def _ingerir_incremental(caminho_arquivo, pasta_partes, caminho_meta, metadados, metadados_novos):
+    """
+    Tenta acrescentar ao cache apenas os pedidos novos da planilha.
+
+    Só é aceito quando as linhas já ingeridas continuam idênticas (mesma
+    assinatura). A exportação do ERP não vem ordenada por DAT_CAD: cada pedido
+    novo vai para o fim da partição do seu mês, seja qual for, e só as
+    partições tocadas são regravadas (normalizar_base_vendas reordena por data).
+    Retorna None quando é preciso reconstruir o cache do zero.
+    """
+    df_novas, info = _ler_vendas_excel(caminho_arquivo, linhas_ja_ingeridas=metadados["linhas"])
+    if info["assinatura_prefixo"] != metadados["assinatura"]:
+        return None
+
+    # Numeração continua a da planilha (é o nº da linha exibido nas tabelas)
+    df_novas.index += metadados["linhas"]
+    metadados_novos.update(
+        linhas=info["linhas"],
+        assinatura=info["assinatura"],
+        colunas=metadados["colunas"],  # o cabeçalho faz parte da assinatura: não mudou
+        partes=_gravar_particoes(pasta_partes, df_novas, metadados["partes"]),
+    )
+    cubo_novas = agregar_cubo_diario(normalizar_base_vendas(df_novas))
+    _atualizar_cubo_incremental(caminho_arquivo, metadados, cubo_novas, metadados_novos)
+    _gravar_metadados_cache(caminho_meta, metadados_novos)
+    absorver_pedidos_kpis(
+        obter_estado_kpis(caminho_arquivo),
+        cubo_novas,
+        _marca_cubo(metadados["assinatura"]),
+        _marca_cubo(metadados_novos["assinatura"]),
+    )
+    return metadados_novos
+
+
+def sincronizar_cache_vendas(caminho_arquivo):
+    """
+    Garante que o cache colunar (Parquet) em disco corresponde à versão atual da
+    planilha de vendas e retorna seus metadados.
+
+    O cache é particionado por ano e mês de DAT_CAD e identificado pela impressão
+    digital do arquivo (mtime + tamanho + hash do conteúdo). Enquanto o Excel não
+    mudar, nada é lido. Quando a exportação do ERP só ganhou pedidos novos no
+    final, apenas essas linhas são convertidas e acrescentadas às suas partições;
+    se o histórico mudou, o cache é refeito do zero.
+    Retorna None se o cache não puder ser gravado (sem pyarrow, sem permissão);
+    a falha fica registrada para aquela versão do arquivo e não é retentada.
+    Lança FileNotFoundError se o arquivo de vendas não existir.
+    """
+    pasta_partes, caminho_meta = _caminhos_cache(caminho_arquivo)
+
+    # Caminho rápido (sem trava): mtime e tamanho iguais dispensam o hash do conteúdo
+    metadados = _ler_metadados_cache(caminho_meta)
+    stat = os.stat(caminho_arquivo)
+    if _cache_em_dia(metadados, pasta_partes, stat):
+        return metadados
+    falhas = obter_falhas_cache_vendas()
+    if (caminho_arquivo, stat.st_mtime_ns, stat.st_size) in falhas:
+        return None
+
+    with obter_trava_cache_vendas():
+        # Outra sessão (ou o monitor) pode ter sincronizado enquanto esta esperava
+        stat = os.stat(caminho_arquivo)
+        versao = (caminho_arquivo, stat.st_mtime_ns, stat.st_size)
+        metadados = _ler_metadados_cache(caminho_meta)
+        if _cache_em_dia(metadados, pasta_partes, stat):
+            return metadados
+        if versao in falhas:
+            return None
+        metadados = _atualizar_cache_vendas(caminho_arquivo, pasta_partes, caminho_meta, metadados, stat)
+        if metadados is None:
+            falhas.add(versao)
+        return metadados
+
+
+def _cache_existe(metadados, pasta_partes):
+    return (
+        metadados is not None
+        and metadados.get("versao") == VERSAO_CACHE
+        and all(os.path.exists(os.path.join(pasta_partes, parte)) for parte in metadados.get("partes", []))
+    )
+
+
+def _cache_em_dia(metadados, pasta_partes, stat):
+    return (
+        _cache_existe(metadados, pasta_partes)
+        and metadados["mtime"] == stat.st_mtime_ns
+        and metadados["tamanho"] == stat.st_size
+    )
+
+
+def _atualizar_cache_vendas(caminho_arquivo, pasta_partes, caminho_meta, metadados, stat):
+    # Chamado com a trava do cache: ingestão incremental ou reconstrução
+    cache_existe = _cache_existe(metadados, pasta_partes)
+    hash_conteudo = calcular_hash_arquivo(caminho_arquivo)
+    metadados_novos = {
+        "versao": VERSAO_CACHE,
+        "mtime": stat.st_mtime_ns,
+        "tamanho": stat.st_size,
+        "hash": hash_conteudo,
+    }
+
+    if cache_existe:
+        try:
+            # Arquivo "tocado" mas com o mesmo conteúdo: só atualiza os metadados
+            if metadados["hash"] == hash_conteudo:
+                metadados_novos = {**metadados, **metadados_novos}
+                _gravar_metadados_cache(caminho_meta, metadados_novos)
+                return metadados_novos
+
+            metadados_incrementais = _ingerir_incremental(caminho_arquivo, pasta_partes, caminho_meta, metadados, metadados_novos)
+            if metadados_incrementais is not None:
+                return metadados_incrementais
+        except Exception as e:
+            print(f"⚠️ Cache de vendas inválido, reconstruindo: {e}")
+
+    return _reconstruir_cache_vendas(caminho_arquivo, pasta_partes, caminho_meta, metadados_novos)
+
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _ler_vendas_sem_cache(caminho_arquivo, mtime, tamanho):
+    return _ler_vendas_excel(caminho_arquivo)[0]
+
+
+def carregar_base_vendas(caminho_arquivo, anos=None, colunas=None):
+    """
+    Carrega pedidos da base de vendas lendo só as partições dos `anos` pedidos
+    (None = todos; o ano None corresponde aos pedidos sem DAT_CAD) e, se
+    informado, só as `colunas` pedidas.
+
+    Sem cache em disco, a planilha inteira é lida uma vez e recortada em memória.
+    Lança FileNotFoundError se o arquivo de vendas não existir.
+    """
+    metadados = sincronizar_cache_vendas(caminho_arquivo)
+    if metadados is None:
+        df = _ler_vendas_sem_cache(caminho_arquivo, *impressao_digital(caminho_arquivo))
+        if anos is not None:
+            datas = df["DAT_CAD"]
+            mascara = datas.dt.year.isin([ano for ano in anos if ano is not None])
+            if None in anos:
+                mascara |= datas.isna()
+            df = df[mascara]
+        return df[colunas] if colunas else df
+
+    partes = metadados["partes"]
+    if anos is not None:
+        partes = [parte for parte in partes if _ano_da_particao(parte) in anos]
+    return _ler_partes_cache(_caminhos_cache(caminho_arquivo)[0], partes, colunas)
+
+
+def anos_com_vendas(caminho_arquivo, incluir_sem_data=False):
+    """
+    Anos com pedidos na base de vendas, em ordem crescente (com None no fim
+    para os pedidos sem DAT_CAD, se pedido e se houver).
+    """
+    metadados = sincronizar_cache_vendas(caminho_arquivo)
+    if metadados is None:
+        datas = _ler_vendas_sem_cache(caminho_arquivo, *impressao_digital(caminho_arquivo))["DAT_CAD"]
+        anos = sorted(int(ano) for ano in datas.dt.year.dropna().unique())
+        sem_data = datas.isna().any()
+    else:
+        anos = sorted({_ano_da_particao(parte) for parte in metadados["partes"]} - {None})
+        sem_data = _nome_particao(None, None) in metadados["partes"]
+    return anos + [None] if incluir_sem_data and sem_data else anos
+
+
+def colunas_vendas(caminho_arquivo):
+    """Colunas de COLUNAS_VENDAS presentes na planilha de vendas."""
+    metadados = sincronizar_cache_vendas(caminho_arquivo)
+    if metadados is None:
+        return list(_ler_vendas_sem_cache(caminho_arquivo, *impressao_digital(caminho_arquivo)).columns)
+    return metadados["colunas"]
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _listar_anos_memoria(caminho_arquivo, mtime, tamanho):
+    return anos_com_vendas(caminho_arquivo)
+
+
+def listar_anos_vendas(caminho_arquivo):
+    return _listar_anos_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
+
+
+def _normalizar_texto_categorico(serie, maiusculas=False, remover_espacos=True):
+    """
+    Normaliza uma coluna de texto e a devolve como categórica.
+
+    A normalização (strip/upper) é feita uma vez por valor distinto, não por linha;
+    as linhas só recebem o código inteiro da categoria já normalizada. Valores que
+    não são texto viram NaN, como aconteceria com o acessor .str.
+    """
+    codigos, distintos = pd.factorize(serie)
+    distintos = pd.Index(distintos, dtype=object)
+    if remover_espacos:
+        distintos = distintos.str.strip()
+    else:
+        distintos = distintos.str.slice()  # só converte não-texto em NaN
+    if maiusculas:
+        distintos = distintos.str.upper()
+
+    # Categorias em ordem alfabética: agrupamentos saem na mesma ordem do texto puro
+    categorias = pd.Index(distintos.dropna().unique()).sort_values()
+    mapa = np.append(categorias.get_indexer(distintos), -1)  # código -1 (vazio) continua vazio
+    novos_codigos = mapa[codigos]
+    return pd.Series(
+        pd.Categorical.from_codes(novos_codigos, categories=categorias),
+        index=serie.index,
+        name=serie.name,
+    )
+
+
+# --- CLASSIFICAÇÃO DE CANAL (PED_OBS_INT) ---
+
+# Canais canônicos; "OUTROS" cobre vazios e textos livres
+CANAIS = ["OPD", "DISTRIBUICAO", "LOJA", "OUTROS"]
+CANAIS_DISTRIBUICAO = ["DISTRIBUICAO", "LOJA"]
+
+# Grafias aceitas para cada canal além da própria (já sem acento e em maiúsculas)
+APELIDOS_CANAL = {
+    "FULL ML": "DISTRIBUICAO",
+}
+# Erros de digitação tolerados em "DISTRIBUICAO" (distância de edição)
+TOLERANCIA_DISTRIBUICAO = 2
+
+
+def _sem_acentos(texto):
+    return "".join(c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c))
+
+
+def _distancia_edicao(a, b):
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        atual = [i]
+        for j, cb in enumerate(b, 1):
+            atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        anterior = atual
+    return anterior[-1]
+
+
+def classificar_canal(valor):
+    """
+    Mapeia uma observação interna (PED_OBS_INT) para o canal canônico.
+
+    Ignora caixa, acentos e espaços repetidos; aceita variações de digitação de
+    DISTRIBUICAO (DISTRIBICAO, DIATRIBUICAO, DSITRIBUICAO...), inclusive seguidas
+    de complemento ("DISTRIBUICAO FULL ML"). Textos livres viram "OUTROS".
+    """
+    if not isinstance(valor, str):
+        return "OUTROS"
+    texto = " ".join(_sem_acentos(valor).upper().split())
+    if texto in APELIDOS_CANAL:
+        return APELIDOS_CANAL[texto]
+    if texto in ("OPD", "LOJA"):
+        return texto
+    primeira_palavra = texto.split(" ", 1)[0] if texto else ""
+    if _distancia_edicao(primeira_palavra, "DISTRIBUICAO") <= TOLERANCIA_DISTRIBUICAO:
+        return "DISTRIBUICAO"
+    return "OUTROS"
+
+
+def _canal_categorico(obs_int):
+    """
+    Coluna CANAL a partir de PED_OBS_INT categórica: classifica cada valor
+    distinto uma única vez e reaproveita os códigos das linhas.
+    """
+    categorias = obs_int.cat.categories
+    mapa = np.array([CANAIS.index(classificar_canal(v)) for v in categorias] + [CANAIS.index("OUTROS")])
+    codigos = mapa[obs_int.cat.codes.to_numpy()]  # código -1 (vazio) cai na última posição: OUTROS
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=CANAIS), index=obs_int.index, name="CANAL")
+
+
+# Em ordem alfabética, para as tabelas dinâmicas manterem a ordem de colunas
+TIPOS_VENDA = ["Distribuição", "OPD", "Outros"]
+
+
+def classificar_tipo_venda(canal, status):
+    """
+    "Tipo Venda" de cada pedido, como categórica:
+    - OPD: canal OPD com status F (faturado).
+    - Distribuição: canal de distribuição (ou loja) com status F ou N.
+    - Outros: todo o resto.
+    """
+    cond_opd = (canal == "OPD") & (status == "F")
+    cond_dist = canal.isin(CANAIS_DISTRIBUICAO) & status.isin(["F", "N"])
+    codigos = np.select(
+        [cond_opd, cond_dist],
+        [TIPOS_VENDA.index("OPD"), TIPOS_VENDA.index("Distribuição")],
+        default=TIPOS_VENDA.index("Outros"),
+    ).astype(np.int8)
+    return pd.Series(pd.Categorical.from_codes(codigos, categories=TIPOS_VENDA), index=canal.index, name="Tipo Venda")
+
+
+# Razões sociais (CLI_RAZ) da Casa do Pedreiro (CDP), excluídas quando "Incluir vendas
+# da Casa do Pedreiro" está desmarcado. Ajustável pela variável de ambiente
+# CRM_CLIENTES_CDP (nomes separados por ";").
+NOMES_CDP_PADRAO = [
+    "DO PEDREIRO DO LITORAL COMERC DE MATERIAIS DE CONSTRUCAO LTD",
+    "DO PEDREIRO DO LITORAL COMERCIO DE MATERIAIS DE CONSTRUCAO",
+]
+NOMES_CDP = sorted(
+    nome.strip() for nome in os.environ.get("CRM_CLIENTES_CDP", ";".join(NOMES_CDP_PADRAO)).split(";") if nome.strip()
+)
+
+
+def normalizar_base_vendas(df):
+    """
+    Prepara a base compartilhada: textos sem espaços nas pontas, PED_TIPO em
+    maiúsculas e colunas de baixa cardinalidade como categóricas, para que os
+    filtros (==, isin) e agrupamentos operem sobre códigos inteiros. Também
+    cria CANAL (classificação canônica de PED_OBS_INT), "Tipo Venda" (OPD /
+    Distribuição / Outros), CDP (cliente da Casa do Pedreiro), DAT_CAD_DATE
+    (o dia do pedido em datetime64) e deixa a base ordenada por data.
+    """
+    colunas = {}
+    for coluna in ("VEN_NOME", "CLI_RAZ", "PED_OBS_INT"):
+        if coluna in df.columns:
+            colunas[coluna] = _normalizar_texto_categorico(df[coluna])
+    if "PED_TIPO" in df.columns:
+        colunas["PED_TIPO"] = _normalizar_texto_categorico(df["PED_TIPO"], maiusculas=True, remover_espacos=False)
+    if "PED_STATUS" in df.columns:
+        colunas["PED_STATUS"] = df["PED_STATUS"].astype("category")
+    if "PED_OBS_INT" in colunas:
+        colunas["CANAL"] = _canal_categorico(colunas["PED_OBS_INT"])
+        if "PED_STATUS" in colunas:
+            colunas["Tipo Venda"] = classificar_tipo_venda(colunas["CANAL"], colunas["PED_STATUS"])
+    if "CLI_RAZ" in colunas:
+        # Pertinência à CDP avaliada uma vez por cliente distinto (categorias), não por pedido
+        colunas["CDP"] = colunas["CLI_RAZ"].isin(NOMES_CDP)
+    # Dia do pedido como datetime64 (meia-noite), sem objetos datetime.date por linha
+    colunas["DAT_CAD_DATE"] = df["DAT_CAD"].dt.normalize()
+    # Ordenada por data (estável, NaT no fim) para permitir recortes por busca binária.
+    # O índice original é mantido, então as tabelas continuam mostrando o nº da linha do ERP.
+    return df.assign(**colunas).sort_values("DAT_CAD", kind="stable", na_position="last")
+
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_ANOS_EM_MEMORIA)
+def _carregar_base_vendas_memoria(caminho_arquivo, mtime, tamanho, ano):
+    return normalizar_base_vendas(carregar_base_vendas(caminho_arquivo, anos=[ano]))
+
+
+def obter_base_vendas(caminho_arquivo, ano):
+    """
+    Ponto único de acesso aos pedidos de um ano (None = pedidos sem DAT_CAD)
+    para os filtros. Só as partições desse ano são lidas do disco.
+
+    Cada base anual é mantida uma única vez por processo (st.cache_resource) e
+    entregue a todas as sessões sem cópia, por isso deve ser tratada como
+    somente leitura. É invalidada automaticamente quando o mtime ou o tamanho
+    do arquivo mudam.
+    """
+    return _carregar_base_vendas_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo), ano)
+
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _listar_vendedores_memoria(caminho_arquivo, mtime, tamanho):
+    # Só a coluna VEN_NOME de cada partição, sem carregar o histórico inteiro
+    nomes = _normalizar_texto_categorico(carregar_base_vendas(caminho_arquivo, colunas=["VEN_NOME"])["VEN_NOME"])
+    return sorted(nomes.dropna().unique().tolist())
+
+
+def fatiar_periodo(base_vendas, data_inicial, data_final):
+    """
+    Recorte [data_inicial, data_final] (dias inclusivos) de uma base ordenada por
+    DAT_CAD, via busca binária: O(log n + k) e sem cópia (iloc com fatia).
+    """
+    dias = base_vendas["DAT_CAD_DATE"].to_numpy()
+    inicio = dias.searchsorted(np.datetime64(data_inicial, "D"), side="left")
+    fim = dias.searchsorted(np.datetime64(data_final, "D"), side="right")
+    return base_vendas.iloc[inicio:fim]
+
+
+def indexar_vendedores(base_vendas):
+    """
+    Índice vendedor -> (posições na base, dias dessas linhas). Como a base está
+    ordenada por data, as posições de cada vendedor também estão, o que permite
+    recortar o período de um vendedor com busca binária.
+    """
+    dias = base_vendas["DAT_CAD_DATE"].to_numpy()
+    grupos = base_vendas.groupby("VEN_NOME", observed=True).indices
+    return {nome: (posicoes, dias[posicoes]) for nome, posicoes in grupos.items()}
+
+
+@st.cache_resource(show_spinner=False, max_entries=MAX_ANOS_EM_MEMORIA)
+def _indexar_vendedores_memoria(caminho_arquivo, mtime, tamanho, ano):
+    return indexar_vendedores(obter_base_vendas(caminho_arquivo, ano))
+
+
+def obter_indice_vendedores(caminho_arquivo, ano):
+    return _indexar_vendedores_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo), ano)
+
+
+def fatiar_vendedor(base_vendas, indice_vendedores, vendedor, periodo=None):
+    """
+    Linhas de um vendedor, opcionalmente limitadas a periodo=(data_inicial, data_final),
+    sem varrer a coluna VEN_NOME.
+    """
+    posicoes, dias = indice_vendedores.get(vendedor, (np.array([], dtype=np.intp), np.array([], dtype="datetime64[ns]")))
+    if periodo:
+        inicio = dias.searchsorted(np.datetime64(periodo[0], "D"), side="left")
+        fim = dias.searchsorted(np.datetime64(periodo[1], "D"), side="right")
+        posicoes = posicoes[inicio:fim]
+    return base_vendas.take(posicoes)
+
+
+def listar_vendedores(caminho_arquivo):
+    return _listar_vendedores_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
+
+
+def _concatenar_recortes(recortes):
+    """
+    Junta recortes de bases anuais diferentes. As colunas categóricas têm
+    categorias próprias em cada ano; quando diferem, são unidas (ordenadas)
+    para que o resultado continue categórico.
+    """
+    recortes = [recorte for recorte in recortes if not recorte.empty] or recortes[:1]
+    if len(recortes) == 1:
+        return recortes[0]
+    tipos = {}
+    for coluna, tipo in recortes[0].dtypes.items():
+        if isinstance(tipo, pd.CategoricalDtype) and any(r[coluna].dtype != tipo for r in recortes[1:]):
+            categorias = set().union(*(r[coluna].cat.categories for r in recortes))
+            tipos[coluna] = pd.CategoricalDtype(sorted(categorias))
+    return pd.concat([recorte.astype(tipos) for recorte in recortes])
+
+
+def _periodo_consulta(mes_referencia=None, data_inicial=None, data_final=None, ano_referencia=None):
+    """
+    Período (data_inicial, data_final) de uma consulta: o intervalo personalizado
+    ou o mês de referência no ano escolhido (ano atual por padrão). None quando
+    não há filtro de data.
+    """
+    if data_inicial and data_final:
+        return (data_inicial, data_final)
+    if mes_referencia:
+        ano = ano_referencia or datetime.date.today().year
+        primeiro_dia = datetime.date(ano, mes_referencia, 1)
+        return (primeiro_dia, (pd.Timestamp(primeiro_dia) + pd.offsets.MonthEnd(0)).date())
+    return None
+
+
+def filtrar_vendas(
+    arquivo_vendas,
+    mes_referencia=None,
+    vendedor_selecionado=None,
+    data_inicial=None,
+    data_final=None,
+    com_cdp=False,
+    ano_referencia=None
+):
+    try:
+        anos_disponiveis = anos_com_vendas(arquivo_vendas)
+        colunas = colunas_vendas(arquivo_vendas)
+    except FileNotFoundError:
+        avisar(f"❌ Erro: Arquivo '{arquivo_vendas}' não encontrado. Verifique o caminho.", "error")
+        return None
+
+    if "VEN_NOME" not in colunas:
+        avisar("❌ Coluna 'VEN_NOME' não encontrada no arquivo de vendas.", "error") # Should not happen if selectbox is populated
+        return pd.DataFrame() # Return empty if critical column is missing
+
+    # DAT_CAD e PED_TOTAL já chegam tipados pelo cache (carregar_base_vendas);
+    # sem nenhum ano, nenhuma DAT_CAD pôde ser lida
+    if not anos_disponiveis:
+        avisar("⚠️ Erro ao processar as datas. Verifique o formato no arquivo de vendas.", "error")
+        return None
+
+    # Recorte por período e vendedor feito pelo motor de consulta configurado.
+    # O resultado é um recorte próprio: as bases compartilhadas nunca são alteradas.
+    periodo = _periodo_consulta(mes_referencia, data_inicial, data_final, ano_referencia)
+    pedidos_no_periodo, df_vendas = obter_motor_consulta()["recortar_vendas"](arquivo_vendas, periodo, vendedor_selecionado)
+
+    # VEN_NOME, CLI_RAZ e PED_OBS_INT já vêm sem espaços e DAT_CAD_DATE já vem
+    # calculada (normalizar_base_vendas)
+
+    if pedidos_no_periodo == 0: # Check after date filter
+        avisar("⚠️ Nenhuma venda encontrada no período selecionado (após filtro de data).")
+        return pd.DataFrame()
+
+    # Filtro de Vendedor
+    if vendedor_selecionado and vendedor_selecionado != "Todos":
+        if df_vendas.empty:
+            avisar(f"⚠️ Nenhuma venda encontrada para o vendedor '{vendedor_selecionado}' (após filtro de vendedor).")
+            # You might want to return df_vendas (which is empty) or the period slice based on desired behavior
+
+
+    if df_vendas.empty: # Check after seller filter
+        # This warning will now be more specific if the seller filter itself results in empty.
+        # No need for an explicit warning here if the one inside the seller filter is sufficient.
+        return pd.DataFrame()
+
+        # Filtro de tipo de pedido: apenas tipo 'V'
+    if "PED_TIPO" in df_vendas.columns:
+        df_vendas = df_vendas[df_vendas["PED_TIPO"] == "V"] # PED_TIPO já vem em maiúsculas
+        if df_vendas.empty:
+            avisar("⚠️ Nenhuma venda encontrada com o tipo de pedido 'V'.")
+            return pd.DataFrame()
+    else:
+        avisar("⚠️ Coluna 'PED_TIPO' não encontrada na base de vendas.")
+        return pd.DataFrame()
+
+
+    if not com_cdp:
+        df_vendas_cdp_filtrado = df_vendas[~df_vendas["CDP"]] # CDP já vem calculada na base
+        if df_vendas_cdp_filtrado.empty and not df_vendas.empty: # only warn if cdp filter made it empty
+             avisar(f"⚠️ Nenhuma venda encontrada após filtro 'Casa do Pedreiro'.")
+        df_vendas = df_vendas_cdp_filtrado
+
+
+    if df_vendas.empty: # Final check
+        avisar("⚠️ Nenhuma venda encontrada após todos os filtros.")
+        return pd.DataFrame()
+
+    return df_vendas
+
+
+# --- CUBO DIÁRIO DE VENDAS (DIA × VENDEDOR × TIPO VENDA × CDP) ---
+
+# Todas as somas do painel (totais OPD/Distribuição, tabela diária, tabela por
+# vendedor, ranking e tendência) são recortes destas dimensões.
+DIMENSOES_CUBO = ["DAT_CAD_DATE", "VEN_NOME", "Tipo Venda", "CDP"]
+
+
+def _tipar_cubo(cubo):
+    """Categóricas do cubo com as mesmas categorias (ordenadas) da base normalizada."""
+    return cubo.assign(**{
+        "VEN_NOME": pd.Categorical(cubo["VEN_NOME"]),
+        "Tipo Venda": pd.Categorical(cubo["Tipo Venda"], categories=TIPOS_VENDA),
+        "CDP": cubo["CDP"].astype(bool),
+    })
+
+
+def _cubo_vazio():
+    return _tipar_cubo(pd.DataFrame({coluna: [] for coluna in DIMENSOES_CUBO + ["PED_TOTAL"]}))
+
+
+def agregar_cubo_diario(base_vendas):
+    """
+    Soma PED_TOTAL dos pedidos tipo 'V' de uma base normalizada por dia,
+    vendedor, "Tipo Venda" e cliente Casa do Pedreiro (CDP).
+
+    O resultado tem uma linha por combinação existente, ordenado por dia, de
+    modo que fatiar_periodo também funciona sobre o cubo.
+    """
+    if not {"PED_TIPO", "Tipo Venda", "CDP"}.issubset(base_vendas.columns):
+        return _cubo_vazio()
+    vendas = base_vendas[base_vendas["PED_TIPO"] == "V"]
+    cubo = vendas.groupby(DIMENSOES_CUBO, observed=True, dropna=False, sort=True)["PED_TOTAL"].sum().reset_index()
+    return _tipar_cubo(cubo)
+
+
+def somar_cubos(cubos):
+    """
+    Soma células de vários cubos (o cubo atual e o dos pedidos recém-ingeridos,
+    ou os cubos de cada ano): custa O(células), não O(pedidos).
+    """
+    if not cubos:
+        return _cubo_vazio()
+    textos = {"VEN_NOME": object, "Tipo Venda": object}
+    juntos = pd.concat([cubo.astype(textos) for cubo in cubos], ignore_index=True)
+    cubo = juntos.groupby(DIMENSOES_CUBO, dropna=False, sort=True)["PED_TOTAL"].sum().reset_index()
+    return _tipar_cubo(cubo)
+
+
+def _marca_cubo(assinatura):
+    """
+    Identifica o conteúdo do cubo em disco: a assinatura da base agregada e a
+    lista de clientes CDP vigente (mudar CRM_CLIENTES_CDP invalida o cubo).
+    """
+    lista_cdp = hashlib.sha256(";".join(NOMES_CDP).encode("utf-8")).hexdigest()[:16]
+    return f"{assinatura}:{lista_cdp}"
+
+
+def _caminho_cubo(caminho_arquivo):
+    pasta_partes = _caminhos_cache(caminho_arquivo)[0]
+    return f"{pasta_partes}.cubo.parquet"
+
+
+def _atualizar_cubo_incremental(caminho_arquivo, metadados, cubo_novas, metadados_novos):
+    """
+    Chamado pela ingestão incremental: soma ao cubo em disco só as células dos
+    pedidos novos (cubo_novas). Se o cubo não corresponder à versão anterior da base, ele fica de
+    fora dos metadados e será refeito por carregar_cubo_vendas.
+    """
+    if metadados.get("cubo") != _marca_cubo(metadados["assinatura"]):
+        return
+    caminho_cubo = _caminho_cubo(caminho_arquivo)
+    try:
+        cubo = pd.read_parquet(caminho_cubo)
+        if not cubo_novas.empty:
+            cubo = somar_cubos([cubo, cubo_novas])
+            caminho_tmp = _caminho_temporario(caminho_cubo)
+            cubo.to_parquet(caminho_tmp, index=False)
+            os.replace(caminho_tmp, caminho_cubo)
+        metadados_novos["cubo"] = _marca_cubo(metadados_novos["assinatura"])
+    except Exception as e:
+        print(f"⚠️ Não foi possível atualizar o cubo de vendas: {e}")
+
+
+def carregar_cubo_vendas(caminho_arquivo):
+    """
+    Cubo diário da versão atual da base de vendas.
 
-def filtrar_vendas(
+    Lido do cache em disco quando corresponde à mesma assinatura da base (a
+    ingestão incremental já o manteve em dia); caso contrário, é agregado a
+    partir das partições pelo motor de consulta e gravado para as próximas cargas.
+    """
+    caminho_meta = _caminhos_cache(caminho_arquivo)[1]
+    caminho_cubo = _caminho_cubo(caminho_arquivo)
+
+    # Com a trava do cache: nenhuma ingestão muda a base entre a leitura dos
+    # metadados, a agregação e a gravação do cubo marcado com essa versão
+    with obter_trava_cache_vendas():
+        metadados = sincronizar_cache_vendas(caminho_arquivo)
+        if metadados is not None and metadados.get("cubo") == _marca_cubo(metadados["assinatura"]):
+            try:
+                return _tipar_cubo(pd.read_parquet(caminho_cubo))
+            except Exception:
+                pass
+
+        cubo = obter_motor_consulta()["agregar_cubo"](caminho_arquivo)
+        if metadados is not None:
+            try:
+                caminho_tmp = _caminho_temporario(caminho_cubo)
+                cubo.to_parquet(caminho_tmp, index=False)
+                os.replace(caminho_tmp, caminho_cubo)
+                _gravar_metadados_cache(caminho_meta, {**metadados, "cubo": _marca_cubo(metadados["assinatura"])})
+            except Exception as e:
+                print(f"⚠️ Não foi possível gravar o cubo de vendas: {e}")
+        return cubo
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _carregar_cubo_memoria(caminho_arquivo, mtime, tamanho):
+    return carregar_cubo_vendas(caminho_arquivo)
+
+
+def obter_cubo_vendas(caminho_arquivo):
+    """Cubo diário compartilhado por todas as sessões (somente leitura)."""
+    return _carregar_cubo_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
+
+
+def filtrar_cubo(
     arquivo_vendas,
     mes_referencia=None,
     vendedor_selecionado=None,
     data_inicial=None,
     data_final=None,
-    com_cdp=False
+    com_cdp=False,
+    ano_referencia=None
 ):
+    """
+    Mesmo recorte de filtrar_vendas (período, vendedor, tipo 'V', CDP), mas
+    sobre as células do cubo diário. Os avisos de recorte vazio ficam a cargo
+    de filtrar_vendas.
+    """
     try:
-        df_vendas = pd.read_excel(arquivo_vendas, dtype={"DAT_CAD": str})
+        cubo = obter_cubo_vendas(arquivo_vendas)
     except FileNotFoundError:
-        st.error(f"❌ Erro: Arquivo '{arquivo_vendas}' não encontrado. Verifique o caminho.")
         return None
 
-    # STRIP KEY STRING COLUMNS EARLY, INCLUDING VEN_NOME
-    if "VEN_NOME" in df_vendas.columns:
-        df_vendas["VEN_NOME"] = df_vendas["VEN_NOME"].str.strip()
+    periodo = _periodo_consulta(mes_referencia, data_inicial, data_final, ano_referencia)
+    if periodo:
+        cubo = fatiar_periodo(cubo, *periodo)
+    if vendedor_selecionado and vendedor_selecionado != "Todos":
+        cubo = cubo[cubo["VEN_NOME"] == vendedor_selecionado]
+    if not com_cdp:
+        cubo = cubo[~cubo["CDP"]]
+    return cubo
+
+
+# --- KPIs INCREMENTAIS (SOMAS CORRENTES DO MÊS) ---
+
+@st.cache_resource(show_spinner=False)
+def obter_estado_kpis(caminho_arquivo):
+    """
+    Estado dos KPIs de um arquivo de vendas, único por processo e mantido de uma
+    versão do arquivo para a outra. Para cada (ano, mês), guarda as somas
+    correntes de PED_TOTAL por (vendedor, tipo de venda, CDP) num vetor de 31
+    dias. "marca" identifica a versão da base refletida (_marca_cubo).
+    """
+    return {"marca": None, "meses": {}, "trava": threading.Lock()}
+
+
+def _somar_celulas_kpis(meses, cubo):
+    # Cada célula do cubo soma seu valor no dia do vetor correspondente: O(células)
+    colunas = [cubo[coluna] for coluna in DIMENSOES_CUBO + ["PED_TOTAL"]]
+    for dia, vendedor, tipo, cdp, valor in zip(*colunas):
+        if pd.isna(dia):
+            continue
+        somas = meses.setdefault((dia.year, dia.month), {})
+        chave = (None if pd.isna(vendedor) else vendedor, tipo, bool(cdp))
+        if chave not in somas:
+            somas[chave] = np.zeros(31)
+        somas[chave][dia.day - 1] += valor
+
+
+def absorver_pedidos_kpis(estado, cubo_novas, marca_anterior, marca_nova):
+    """
+    Soma ao estado as células do cubo dos pedidos recém-ingeridos, em O(delta).
+    Só vale quando o estado reflete exatamente a versão anterior da base; se
+    não, ele é refeito a partir do cubo na próxima sincronização.
+    """
+    with estado["trava"]:
+        if estado["marca"] != marca_anterior:
+            return False
+        _somar_celulas_kpis(estado["meses"], cubo_novas)
+        estado["marca"] = marca_nova
+        return True
+
+
+def sincronizar_estado_kpis(caminho_arquivo):
+    """
+    Estado dos KPIs em dia com a versão atual da base de vendas. Pedidos novos
+    no final da planilha já chegam pela ingestão incremental
+    (absorver_pedidos_kpis); o cubo inteiro só é percorrido quando o histórico
+    muda ou o processo acaba de subir.
+    Lança FileNotFoundError se o arquivo de vendas não existir.
+    """
+    estado = obter_estado_kpis(caminho_arquivo)
+    metadados = sincronizar_cache_vendas(caminho_arquivo)
+    if metadados is not None:
+        marca = _marca_cubo(metadados["assinatura"])
     else:
-        st.error("❌ Coluna 'VEN_NOME' não encontrada no arquivo de vendas.") # Should not happen if selectbox is populated
-        return pd.DataFrame() # Return empty if critical column is missing
+        marca = "sem-cache:{}:{}".format(*impressao_digital(caminho_arquivo))
+    if estado["marca"] == marca:
+        return estado
 
-    if "CLI_RAZ" in df_vendas.columns:
-        df_vendas["CLI_RAZ"] = df_vendas["CLI_RAZ"].str.strip()
-    if "PED_OBS_INT" in df_vendas.columns:
-        df_vendas["PED_OBS_INT"] = df_vendas["PED_OBS_INT"].str.strip()
-    # END OF STRIPPING
+    meses = {}
+    _somar_celulas_kpis(meses, obter_cubo_vendas(caminho_arquivo))
+    with estado["trava"]:
+        estado["meses"] = meses
+        estado["marca"] = marca
+    return estado
 
-    df_vendas["DAT_CAD"] = pd.to_datetime(df_vendas["DAT_CAD"], errors="coerce")
 
-    if df_vendas["DAT_CAD"].isna().all():
-        st.error("⚠️ Erro ao processar as datas. Verifique o formato no arquivo de vendas.")
-        return None
+def vendas_diarias_kpis(estado, ano, mes_referencia, vendedor_selecionado=None, com_cdp=True):
+    """
+    Vendas por dia do mês, (OPD, Distribuição) x dias do mês, a partir das somas
+    correntes: custa O(vendedores do mês), não importa o tamanho do histórico.
+    """
+    dias_no_mes = limites_mes(ano, mes_referencia)[1].item().day
+    por_dia = np.zeros((2, 31))
+    with estado["trava"]:
+        for (vendedor, tipo, cdp), valores in estado["meses"].get((ano, mes_referencia), {}).items():
+            if vendedor_selecionado and vendedor_selecionado != "Todos" and vendedor != vendedor_selecionado:
+                continue
+            if cdp and not com_cdp:
+                continue
+            if tipo == "OPD":
+                por_dia[0] += valores
+            elif tipo == "Distribuição":
+                por_dia[1] += valores
+    return por_dia[:, :dias_no_mes]
+
+
+def realizado_kpis(estado, ano, mes_referencia, vendedor_selecionado=None, com_cdp=True):
+    """Totais (OPD, Distribuição) do mês, como processar_vendas, a partir das somas correntes."""
+    total_opd, total_amc = vendas_diarias_kpis(estado, ano, mes_referencia, vendedor_selecionado, com_cdp).sum(axis=1)
+    return float(total_opd), float(total_amc)
 
-    df_vendas["CLI_RAZ"] = df_vendas["CLI_RAZ"].str.strip() # Already stripped, but safe to keep if order changes
-    df_vendas["PED_OBS_INT"] = df_vendas["PED_OBS_INT"].str.strip() # Already stripped
-    df_vendas["PED_TOTAL"] = pd.to_numeric(df_vendas["PED_TOTAL"], errors="coerce").fillna(0)
 
-    df_vendas["DAT_CAD_DATE"] = df_vendas["DAT_CAD"].dt.date
+# --- MOTORES DE CONSULTA ---
 
-    if data_inicial and data_final:
-        data_inicial_dt = pd.to_datetime(data_inicial).date()
-        data_final_dt = pd.to_datetime(data_final).date()
-        df_vendas = df_vendas[
-            (df_vendas["DAT_CAD_DATE"] >= data_inicial_dt) &
-            (df_vendas["DAT_CAD_DATE"] <= data_final_dt)
-        ]
-    elif mes_referencia:
-        df_vendas = df_vendas[df_vendas["DAT_CAD"].dt.month == mes_referencia]
-        ano_atual = datetime.date.today().year
-        df_vendas = df_vendas[df_vendas["DAT_CAD"].dt.year == ano_atual]
+# Motor usado nas varreduras de pedidos (recorte por período/vendedor e
+# reconstrução do cubo). "pandas" (padrão) usa as bases anuais em memória;
+# "duckdb" consulta direto as partições Parquet, de forma preguiçosa e com
+# várias threads, trazendo para o pandas só os pedidos que passam nos filtros.
+# Ajustável pela variável de ambiente CRM_MOTOR_CONSULTA.
+MOTOR_CONSULTA = os.environ.get("CRM_MOTOR_CONSULTA", "pandas")
 
-    if df_vendas.empty: # Check after date filter
-        st.warning("⚠️ Nenhuma venda encontrada no período selecionado (após filtro de data).")
-        return pd.DataFrame()
+# Equivalente em SQL do str.strip() aplicado por normalizar_base_vendas
+_SQL_SEM_ESPACOS = "regexp_replace({}, '^\\s+|\\s+$', '', 'g')"
 
-    # Filtro de Vendedor
+
+def _recortar_vendas_pandas(arquivo_vendas, periodo, vendedor_selecionado):
+    """
+    Pedidos do período (e do vendedor, se houver), a partir das bases anuais
+    normalizadas em memória: busca binária por data e índice por vendedor.
+    Retorna (nº de pedidos no período, recorte).
+    """
+    anos = anos_com_vendas(arquivo_vendas, incluir_sem_data=periodo is None)
+    if periodo:
+        anos = [ano for ano in anos if periodo[0].year <= ano <= periodo[1].year]
+    bases = {ano: obter_base_vendas(arquivo_vendas, ano) for ano in anos}
+
+    recortes = [fatiar_periodo(base, *periodo) if periodo else base for base in bases.values()]
+    pedidos_no_periodo = sum(len(recorte) for recorte in recortes)
+    if pedidos_no_periodo == 0:
+        return 0, pd.DataFrame()
     if vendedor_selecionado and vendedor_selecionado != "Todos":
-        # Now VEN_NOME in df_vendas is stripped, and vendedor_selecionado is also stripped.
-        # Casing should also match because vendedor_selecionado comes from unique values of this column.
-        df_vendas_vendedor_filtrado = df_vendas[df_vendas["VEN_NOME"] == vendedor_selecionado]
-        if df_vendas_vendedor_filtrado.empty:
-            st.warning(f"⚠️ Nenhuma venda encontrada para o vendedor '{vendedor_selecionado}' (após filtro de vendedor).")
-            # You might want to return df_vendas_vendedor_filtrado (which is empty) or df_vendas based on desired behavior
-        df_vendas = df_vendas_vendedor_filtrado
+        # Partição do vendedor (índice pré-calculado por ano) já recortada pelo mesmo período
+        recortes = [
+            fatiar_vendedor(base, obter_indice_vendedores(arquivo_vendas, ano), vendedor_selecionado, periodo)
+            for ano, base in bases.items()
+        ]
+    return pedidos_no_periodo, _concatenar_recortes(recortes)
 
 
-    if df_vendas.empty: # Check after seller filter
-        # This warning will now be more specific if the seller filter itself results in empty.
-        # No need for an explicit warning here if the one inside the seller filter is sufficient.
-        return pd.DataFrame()
+def _agregar_cubo_pandas(arquivo_vendas):
+    # Ano a ano, sem manter o histórico inteiro em memória
+    return somar_cubos([
+        agregar_cubo_diario(normalizar_base_vendas(carregar_base_vendas(arquivo_vendas, anos=[ano])))
+        for ano in anos_com_vendas(arquivo_vendas, incluir_sem_data=True)
+    ])
 
-    nomes_cdp = [
-        "DO PEDREIRO DO LITORAL COMERC DE MATERIAIS DE CONSTRUCAO LTD",
-        "DO PEDREIRO DO LITORAL COMERCIO DE MATERIAIS DE CONSTRUCAO",
-    ]
 
-        # Filtro de tipo de pedido: apenas tipo 'V'
-    if "PED_TIPO" in df_vendas.columns:
-        df_vendas = df_vendas[df_vendas["PED_TIPO"].str.upper() == "V"]
-        if df_vendas.empty:
-            st.warning("⚠️ Nenhuma venda encontrada com o tipo de pedido 'V'.")
-            return pd.DataFrame()
-    else:
-        st.warning("⚠️ Coluna 'PED_TIPO' não encontrada na base de vendas.")
-        return pd.DataFrame()
+def _particoes_duckdb(arquivo_vendas, periodo=None):
+    """
+    Lista SQL com as partições Parquet que o período toca (todas, sem período),
+    ou None se não houver cache em disco.
+    """
+    metadados = sincronizar_cache_vendas(arquivo_vendas)
+    if metadados is None:
+        return None
+    partes = metadados["partes"]
+    if periodo:
+        primeira, ultima = _nome_particao(periodo[0].year, periodo[0].month), _nome_particao(periodo[1].year, periodo[1].month)
+        partes = [parte for parte in partes if _ano_da_particao(parte) is not None and primeira <= parte <= ultima]
+    pasta_partes = _caminhos_cache(arquivo_vendas)[0]
+    caminhos = [os.path.join(pasta_partes, parte).replace("'", "''") for parte in partes]
+    return "[" + ", ".join(f"'{caminho}'" for caminho in caminhos) + "]"
 
 
-    if not com_cdp:
-        df_vendas_cdp_filtrado = df_vendas[~df_vendas["CLI_RAZ"].isin(nomes_cdp)]
-        if df_vendas_cdp_filtrado.empty and not df_vendas.empty: # only warn if cdp filter made it empty
-             st.warning(f"⚠️ Nenhuma venda encontrada após filtro 'Casa do Pedreiro'.")
-        df_vendas = df_vendas_cdp_filtrado
+def _pedidos_duckdb(resultado):
+    """DataFrame de uma consulta duckdb com os mesmos tipos e índice do cache pandas."""
+    df = resultado.df().set_index("__index_level_0__").rename_axis(None)
+    tipos = {nome: tipo for nome, tipo in TIPOS_COLUNAS_VENDAS.items() if nome in df.columns}
+    return df.astype(tipos)
 
 
-    if df_vendas.empty: # Final check
-        st.warning("⚠️ Nenhuma venda encontrada após todos os filtros.")
-        return pd.DataFrame()
+def _recortar_vendas_duckdb(arquivo_vendas, periodo, vendedor_selecionado):
+    """
+    Mesmo contrato de _recortar_vendas_pandas, com os filtros de data e de
+    vendedor empurrados para o duckdb: só as partições do período são lidas e
+    só os pedidos selecionados são normalizados.
+    """
+    import duckdb
+
+    particoes = _particoes_duckdb(arquivo_vendas, periodo)
+    if particoes is None:
+        return _recortar_vendas_pandas(arquivo_vendas, periodo, vendedor_selecionado)
+    if particoes == "[]":
+        return 0, pd.DataFrame()
+
+    condicoes, parametros = [], []
+    if periodo:
+        condicoes.append("DAT_CAD >= ? AND DAT_CAD < ?")
+        parametros += [pd.Timestamp(periodo[0]).to_pydatetime(), (pd.Timestamp(periodo[1]) + pd.Timedelta(days=1)).to_pydatetime()]
+    filtro_periodo = " AND ".join(condicoes) or "TRUE"
+
+    conexao = duckdb.connect()
+    try:
+        pedidos_no_periodo = conexao.execute(
+            f"SELECT count(*) FROM read_parquet({particoes}) WHERE {filtro_periodo}", parametros
+        ).fetchone()[0]
+        if pedidos_no_periodo == 0:
+            return 0, pd.DataFrame()
+        if vendedor_selecionado and vendedor_selecionado != "Todos":
+            condicoes.append(f"{_SQL_SEM_ESPACOS.format('VEN_NOME')} = ?")
+            parametros.append(vendedor_selecionado)
+        df = _pedidos_duckdb(conexao.execute(
+            f"SELECT * FROM read_parquet({particoes}) WHERE {' AND '.join(condicoes) or 'TRUE'} "
+            "ORDER BY DAT_CAD NULLS LAST, __index_level_0__",
+            parametros,
+        ))
+    finally:
+        conexao.close()
+    return pedidos_no_periodo, normalizar_base_vendas(df)
+
+
+def _agregar_cubo_duckdb(arquivo_vendas):
+    """
+    Cubo diário com a pré-agregação no duckdb: soma por dia e valores brutos
+    (vendedor, cliente, observação, status) dos pedidos tipo 'V'. A
+    classificação de canal e a agregação final seguem as do motor pandas,
+    sobre essas linhas já reduzidas.
+    """
+    import duckdb
+
+    particoes = _particoes_duckdb(arquivo_vendas)
+    if particoes is None:
+        return _agregar_cubo_pandas(arquivo_vendas)
+    if particoes == "[]":
+        return _cubo_vazio()
+
+    conexao = duckdb.connect()
+    try:
+        df = _pedidos_duckdb(conexao.execute(
+            "SELECT min(__index_level_0__) AS __index_level_0__, date_trunc('day', DAT_CAD) AS DAT_CAD, "
+            "VEN_NOME, CLI_RAZ, PED_OBS_INT, PED_STATUS, PED_TIPO, sum(PED_TOTAL) AS PED_TOTAL "
+            f"FROM read_parquet({particoes}) WHERE upper(PED_TIPO) = 'V' "
+            "GROUP BY ALL ORDER BY 2 NULLS LAST, 1"
+        ))
+    finally:
+        conexao.close()
+    return agregar_cubo_diario(normalizar_base_vendas(df))
+
+
+MOTORES_CONSULTA = {
+    "pandas": {"recortar_vendas": _recortar_vendas_pandas, "agregar_cubo": _agregar_cubo_pandas},
+    "duckdb": {"recortar_vendas": _recortar_vendas_duckdb, "agregar_cubo": _agregar_cubo_duckdb},
+}
+
+
+@st.cache_resource(show_spinner=False)
+def _escolher_motor_consulta(nome):
+    if nome not in MOTORES_CONSULTA:
+        print(f"⚠️ Motor de consulta '{nome}' desconhecido: usando pandas.")
+        return "pandas"
+    if nome == "duckdb":
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            print("⚠️ duckdb não instalado: usando o motor pandas.")
+            return "pandas"
+    return nome
 
-    return df_vendas
+
+def obter_motor_consulta():
+    """Funções do motor configurado em CRM_MOTOR_CONSULTA (pandas se indisponível)."""
+    return MOTORES_CONSULTA[_escolher_motor_consulta(MOTOR_CONSULTA)]
 
 
 # --- FUNÇÃO PROCESSAR_VENDAS (Agora usa filtrar_vendas) ---
@@ -481,16 +1713,11 @@ def processar_vendas(df_vendas_filtrado):
     if df_vendas_filtrado is None or df_vendas_filtrado.empty:
         return 0.0, 0.0
 
-    # Filtro base para OPD e faturado
-    filtro_opd = (df_vendas_filtrado["PED_OBS_INT"] == "OPD") & (df_vendas_filtrado["PED_STATUS"] == "F")
-    total_opd = df_vendas_filtrado[filtro_opd]["PED_TOTAL"].sum()
-
-    # Soma dos valores para AMC
-    # total_amc = df_vendas_filtrado[df_vendas_filtrado["PED_OBS_INT"].isin([ "DISTRIBICAO", "DISTRIBUICAO", "DISTRIBUIÇÃO", "LOJA"])]["PED_TOTAL"].sum()
-
-    # Filtro para pedidos de distribuição com status F ou N
-    filtro_distribuicao = df_vendas_filtrado["PED_OBS_INT"].isin([ "DISTRIBICAO", "DISTRIBUICAO", "DISTRIBUIÇÃO", "DIATRIBUICAO", "LOJA"]) & (df_vendas_filtrado["PED_STATUS"].isin(["F", "N"]))
-    total_amc = df_vendas_filtrado[filtro_distribuicao]["PED_TOTAL"].sum()
+    # Aceita pedidos (filtrar_vendas) ou células do cubo diário (filtrar_cubo):
+    # ambos trazem "Tipo Venda" já classificado e PED_TOTAL
+    tipo_venda = df_vendas_filtrado["Tipo Venda"]
+    total_opd = df_vendas_filtrado["PED_TOTAL"][tipo_venda == "OPD"].sum()
+    total_amc = df_vendas_filtrado["PED_TOTAL"][tipo_venda == "Distribuição"].sum()
 
     return float(total_opd), float(total_amc)
 
@@ -521,23 +1748,22 @@ def calcular_status(realizado, metas, mes_referencia, feriados):
             break
     return status
 
-def comparar_com_metas(planilha_metas, mes_referencia, total_opd, total_amc):
-    meses = ["jan", "fev", "mar", "abr", "mai", "jun", "jul", "ago", "set", "out", "nov", "dez"]
-    mes_coluna = meses[mes_referencia - 1]
+def comparar_com_metas(matriz_metas, aba, mes_referencia, total_opd, total_amc):
+    mes_coluna = MESES_ABREV[mes_referencia - 1]
 
     try:
-        meta_opd = float(planilha_metas.loc[planilha_metas["Categoria"] == "META AN OPD", mes_coluna].values[0])
-        meta_desaf_opd = float(planilha_metas.loc[planilha_metas["Categoria"] == "META DESAF OPD", mes_coluna].values[0])
-        meta_distri = float(planilha_metas.loc[planilha_metas["Categoria"] == "META AN DISTRI", mes_coluna].values[0])
-        meta_desaf_distri = float(planilha_metas.loc[planilha_metas["Categoria"] == "META DESAF DISTRI", mes_coluna].values[0])
-        super_meta_distri = float(planilha_metas.loc[planilha_metas["Categoria"] == "SUPER META DISTRI", mes_coluna].values[0])
+        meta_opd = buscar_meta(matriz_metas, aba, "META AN OPD", mes_referencia)
+        meta_desaf_opd = buscar_meta(matriz_metas, aba, "META DESAF OPD", mes_referencia)
+        meta_distri = buscar_meta(matriz_metas, aba, "META AN DISTRI", mes_referencia)
+        meta_desaf_distri = buscar_meta(matriz_metas, aba, "META DESAF DISTRI", mes_referencia)
+        super_meta_distri = buscar_meta(matriz_metas, aba, "SUPER META DISTRI", mes_referencia)
 
         return {
             "OPD": {"Realizado": total_opd, "Meta Mensal": meta_opd, "Meta Desafio": meta_desaf_opd},
             "AMC": {"Realizado": total_amc, "Meta Mensal": meta_distri, "Meta Desafio": meta_desaf_distri, "Super Meta": super_meta_distri},
         }
     except (IndexError, KeyError) as e:
-        st.error(f"❌ Erro ao ler metas para o mês '{mes_coluna}' na aba selecionada. Verifique a planilha. Detalhe: {e}")
+        avisar(f"❌ Erro ao ler metas para o mês '{mes_coluna}' na aba selecionada. Verifique a planilha. Detalhe: {e}", "error")
         return {}
 
 
@@ -553,53 +1779,250 @@ def gerar_grafico(categoria, dados, titulo):
     return fig
 
 
-def calcular_dias_uteis_restantes(mes_referencia, incluir_hoje=True, feriados=None):
-    hoje = datetime.date.today()
-    ano = hoje.year
+# --- CALENDÁRIO DE DIAS ÚTEIS ---
 
-    if ano > hoje.year or (ano == hoje.year and mes_referencia < hoje.month):
-        return 0
+def obter_calendario_uteis(feriados=None):
+    """
+    Calendário NumPy de dias úteis (segunda a sexta, menos os feriados do registro
+    de carregar_feriados). Com ele, np.busday_count conta os dias úteis de
+    qualquer intervalo sem percorrer o período dia a dia.
+    """
+    if feriados is None:
+        return np.busdaycalendar(weekmask="1111100")
+    return feriados["calendario"]
 
-    if mes_referencia == hoje.month:
-        data_inicio = hoje
-    else:
-        data_inicio = datetime.date(ano, mes_referencia, 1)
 
-    if mes_referencia == 12:
-        ultimo_dia = datetime.date(ano, 12, 31)
-    else:
-        ultimo_dia = datetime.date(ano, mes_referencia + 1, 1) - datetime.timedelta(days=1)
+def contar_dias_uteis(data_inicial, data_final, calendario):
+    """
+    Dias úteis em [data_inicial, data_final], dias inclusivos. Aceita datas
+    escalares ou arrays (consultas em lote); intervalo invertido conta 0.
+    """
+    inicio = np.asarray(data_inicial, dtype="datetime64[D]")
+    fim = np.asarray(data_final, dtype="datetime64[D]") + 1
+    return np.busday_count(inicio, np.maximum(inicio, fim), busdaycal=calendario)
 
-    dias = pd.date_range(data_inicio, ultimo_dia).to_list()
-    feriados = feriados or []
 
-    dias_uteis_count = 0
-    for dia in dias:
-        dia_date = dia.date()
-        if dia.weekday() < 5 and dia_date not in feriados:
-            if incluir_hoje:
-                dias_uteis_count += 1
-            elif dia_date > hoje:
-                dias_uteis_count += 1
-    return dias_uteis_count
+def limites_mes(anos, meses):
+    """Primeiro e último dia de cada (ano, mês), como arrays datetime64[D]."""
+    mes = ((np.asarray(anos) - 1970) * 12 + np.asarray(meses) - 1).astype("datetime64[M]")
+    return mes.astype("datetime64[D]"), (mes + 1).astype("datetime64[D]") - 1
 
 
-def calcular_dias_uteis_passados(mes_referencia, incluir_hoje=False, feriados=None):
-    hoje = datetime.date.today()
-    ano = hoje.year
-    feriados = feriados or []
+def dias_uteis_mes(anos, meses, calendario, hoje=None, incluir_hoje_passados=False, incluir_hoje_restantes=True):
+    """
+    Dias úteis (passados, restantes, total) de cada (ano, mês), em lote.
+
+    Passados vão do dia 1 até ontem (ou até hoje) e restantes de hoje (ou de
+    amanhã) até o fim do mês: meses encerrados não têm dias restantes e meses
+    futuros não têm dias passados. anos/meses podem ser escalares ou arrays.
+    """
+    hoje = np.datetime64(hoje or datetime.date.today(), "D")
+    primeiro, ultimo = limites_mes(anos, meses)
+    fim_passados = np.minimum(ultimo, hoje if incluir_hoje_passados else hoje - 1)
+    inicio_restantes = np.maximum(primeiro, hoje if incluir_hoje_restantes else hoje + 1)
+    return (
+        contar_dias_uteis(primeiro, fim_passados, calendario),
+        contar_dias_uteis(inicio_restantes, ultimo, calendario),
+        contar_dias_uteis(primeiro, ultimo, calendario),
+    )
+
+
+def gerar_grafico_ritmo(ritmo, titulo):
+    fig = go.Figure()
+    cores = ["#313334", "#e93900", "#e02500"]
+    for nivel, cor in zip(ritmo.columns.drop(["Data", "Realizado Acumulado"]), cores):
+        fig.add_trace(go.Scatter(
+            x=ritmo["Data"], y=ritmo[nivel],
+            mode="lines", name=f"Ritmo {nivel}",
+            line=dict(color=cor, dash="dash"),
+        ))
+    fig.add_trace(go.Scatter(
+        x=ritmo["Data"], y=ritmo["Realizado Acumulado"],
+        mode="lines+markers", name="Realizado Acumulado",
+        line=dict(color="#f35202", width=3),
+    ))
+    fig.update_layout(
+        title=titulo,
+        xaxis_title="Data",
+        yaxis_title="Valor Acumulado (R$)",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        hovermode="x unified",
+    )
+    return fig
+
+
+def calcular_dias_uteis_restantes(mes_referencia, incluir_hoje=True, feriados=None, ano=None):
+    _, restantes, _ = dias_uteis_mes(
+        ano or datetime.date.today().year, mes_referencia, obter_calendario_uteis(feriados),
+        incluir_hoje_restantes=incluir_hoje,
+    )
+    return int(restantes)
+
+
+def calcular_dias_uteis_passados(mes_referencia, incluir_hoje=False, feriados=None, ano=None):
+    passados, _, _ = dias_uteis_mes(
+        ano or datetime.date.today().year, mes_referencia, obter_calendario_uteis(feriados),
+        incluir_hoje_passados=incluir_hoje,
+    )
+    return int(passados)
+
 
-    primeiro_dia = datetime.date(ano, mes_referencia, 1)
-    dia_final = min(hoje, datetime.date(ano, mes_referencia + 1, 1) - datetime.timedelta(days=1) if mes_referencia < 12 else datetime.date(ano, 12, 31))
+# --- PLACAR DA EQUIPE ---
 
-    dias = pd.date_range(primeiro_dia, dia_final).to_list()
-    dias_uteis_count = 0
-    for dia in dias:
-        dia_date = dia.date()
-        if dia.weekday() < 5 and dia_date not in feriados:
-            if incluir_hoje or dia_date < hoje:
-                dias_uteis_count += 1
-    return dias_uteis_count
+# Níveis de meta e as categorias (OPD, Distribuição) somadas em cada um, como
+# nos cartões de tendência da Visão Geral
+NIVEIS_META = {
+    "Meta Mensal": ("META AN OPD", "META AN DISTRI"),
+    "Meta Desafio": ("META DESAF OPD", "META DESAF DISTRI"),
+    "Super Meta": ("META DESAF OPD", "SUPER META DISTRI"),
+}
+
+
+def projetar_metas(realizado, metas, dias_passados, dias_restantes):
+    """
+    Média diária, tendência, necessário/dia e diferença tendência - meta, para
+    arrays de realizado (n,) e metas (n, níveis). Os dias úteis podem ser
+    escalares ou arrays (n,); como nos cartões, contam no mínimo 1.
+    """
+    realizado = np.asarray(realizado, dtype=float)
+    metas = np.asarray(metas, dtype=float)
+    dias_passados = np.maximum(1, dias_passados)
+    dias_restantes = np.maximum(1, dias_restantes)
+
+    media_diaria = realizado / dias_passados
+    tendencia = realizado + media_diaria * dias_restantes
+    necessario = np.maximum(0, (metas - realizado[..., None]) / np.expand_dims(dias_restantes, -1))
+    return {
+        "media_diaria": media_diaria,
+        "tendencia": tendencia,
+        "necessario_dia": necessario,
+        "diferenca": tendencia[..., None] - metas,
+    }
+
+
+def metas_por_nivel(matriz_metas, abas, mes_referencia):
+    """
+    Metas (len(abas), níveis) do mês, somando as categorias de cada nível.
+    Abas ausentes/vazias (ou None) e metas zeradas ficam NaN (sem meta).
+    """
+    metas = np.full((len(abas), len(NIVEIS_META), 2), np.nan)
+    if matriz_metas is not None and matriz_metas["indice_categoria"]:
+        indice_aba = matriz_metas["indice_aba"]
+        linhas = [i for i, aba in enumerate(abas) if aba in indice_aba and aba not in matriz_metas["abas_vazias"]]
+        categorias = np.array([
+            [matriz_metas["indice_categoria"].get(categoria, -1) for categoria in par]
+            for par in NIVEIS_META.values()
+        ])
+        valores = matriz_metas["valores"][[indice_aba[abas[i]] for i in linhas]][:, :, mes_referencia - 1]
+        metas[linhas] = np.where(categorias >= 0, valores[:, categorias], np.nan)
+
+    metas = metas.sum(axis=2)
+    return np.where(metas > 0, metas, np.nan)
+
+
+def calcular_placar_equipe(cubo, matriz_metas, ano, mes_referencia, calendario, com_cdp=True, hoje=None):
+    """
+    Placar do mês de toda a equipe, numa passada vetorizada sobre o cubo diário
+    e a matriz de metas: realizado OPD/Distribuição, média diária, tendência e,
+    por nível de meta, o necessário/dia e a diferença tendência - meta.
+
+    Uma linha por vendedor com vendas OPD/Distribuição no mês ou com aba própria
+    de metas, mais a linha da empresa (aba GERAL). Vendedores sem aba própria
+    ficam sem metas.
+    """
+    primeiro, ultimo = limites_mes(ano, mes_referencia)
+    cubo = fatiar_periodo(cubo, primeiro, ultimo)
+    if not com_cdp:
+        cubo = cubo[~cubo["CDP"]]
+
+    # Realizado (vendedor × tipo de venda) por soma ponderada dos códigos das células
+    vendedores = cubo["VEN_NOME"].cat.categories
+    codigo_vendedor = cubo["VEN_NOME"].cat.codes.to_numpy()
+    codigo_tipo = cubo["Tipo Venda"].cat.codes.to_numpy()
+    valores = cubo["PED_TOTAL"].to_numpy(dtype=float)
+    com_vendedor = codigo_vendedor >= 0
+    realizado = np.bincount(
+        codigo_vendedor[com_vendedor] * len(TIPOS_VENDA) + codigo_tipo[com_vendedor],
+        weights=valores[com_vendedor],
+        minlength=len(vendedores) * len(TIPOS_VENDA),
+    ).reshape(len(vendedores), len(TIPOS_VENDA))
+    empresa = np.bincount(codigo_tipo, weights=valores, minlength=len(TIPOS_VENDA))
+
+    abas = [ABAS_META_VENDEDOR.get(nome.upper()) for nome in vendedores]
+    # Só OPD e Distribuição contam (são as colunas do placar): quem vendeu apenas "Outros" fica de fora
+    colunas_placar = [TIPOS_VENDA.index("OPD"), TIPOS_VENDA.index("Distribuição")]
+    manter = realizado[:, colunas_placar].any(axis=1) | np.array([aba is not None for aba in abas], dtype=bool)
+    nomes = list(vendedores[manter]) + ["**TOTAL GERAL**"]
+    abas = [aba for aba, m in zip(abas, manter) if m] + [ABA_META_GERAL]
+    realizado = np.vstack([realizado[manter], empresa])
+
+    opd = realizado[:, TIPOS_VENDA.index("OPD")]
+    distribuicao = realizado[:, TIPOS_VENDA.index("Distribuição")]
+    total = opd + distribuicao
+
+    passados, restantes, _ = dias_uteis_mes(ano, mes_referencia, calendario, hoje)
+    metas = metas_por_nivel(matriz_metas, abas, mes_referencia)
+    projecao = projetar_metas(total, metas, passados, restantes)
+
+    placar = pd.DataFrame({
+        "Vendedor": nomes,
+        "Aba de Metas": [aba or "-" for aba in abas],
+        "OPD": opd,
+        "Distribuição": distribuicao,
+        "Realizado": total,
+        "Média Diária": projecao["media_diaria"],
+        "Tendência": projecao["tendencia"],
+    })
+    for i, nivel in enumerate(NIVEIS_META):
+        placar[nivel] = metas[:, i]
+        placar[f"Necessário/dia ({nivel})"] = projecao["necessario_dia"][:, i]
+        placar[f"Tendência x {nivel}"] = projecao["diferenca"][:, i]
+
+    # Vendedores por realizado (maior primeiro) e a empresa por último
+    ordem = np.r_[np.argsort(-total[:-1], kind="stable"), len(total) - 1]
+    return placar.iloc[ordem].reset_index(drop=True)
+
+
+def calcular_ritmo_metas(vendas_por_dia, metas, ano, mes_referencia, calendario, hoje=None):
+    """
+    Ritmo do mês dia a dia: realizado acumulado e, para cada nível de meta, a
+    trajetória da meta proporcional aos dias úteis já decorridos. Tudo numa
+    passada vetorizada: cumsum das vendas diárias e np.busday_count sobre
+    todos os dias do mês de uma vez.
+
+    vendas_por_dia: vendas de cada dia do mês (vendas_diarias_kpis somado por tipo).
+    metas: {nível: valor}; níveis sem meta (NaN) ficam de fora.
+    Dias depois de hoje ficam sem realizado (NaN).
+    """
+    primeiro, ultimo = limites_mes(ano, mes_referencia)
+    dias = np.arange(primeiro, ultimo + 1)
+    uteis_decorridos = contar_dias_uteis(primeiro, dias, calendario)
+    fracao_meta = uteis_decorridos / max(1, uteis_decorridos[-1])
+
+    hoje = np.datetime64(hoje or datetime.date.today(), "D")
+    realizado = np.where(dias <= hoje, np.cumsum(vendas_por_dia), np.nan)
+
+    ritmo = pd.DataFrame({"Data": dias.astype("datetime64[ns]"), "Realizado Acumulado": realizado})
+    for nivel, valor in metas.items():
+        if not np.isnan(valor):
+            ritmo[nivel] = valor * fracao_meta
+    return ritmo
+
+
+def gerar_placar_equipe(arquivo_vendas, caminho_metas, ano, mes_referencia, com_cdp, feriados):
+    try:
+        cubo = obter_cubo_vendas(arquivo_vendas)
+    except FileNotFoundError:
+        st.info("Nenhuma venda encontrada para montar o placar da equipe.")
+        return pd.DataFrame()
+    try:
+        matriz_metas = obter_matriz_metas(caminho_metas)
+    except FileNotFoundError:
+        st.warning(f"⚠️ Arquivo de Metas '{caminho_metas}' não encontrado. O placar será exibido sem metas.")
+        matriz_metas = None
+    return calcular_placar_equipe(
+        cubo, matriz_metas, ano, mes_referencia, obter_calendario_uteis(feriados), com_cdp=com_cdp
+    )
 
 
 # --- NOVAS FUNÇÕES PARA TABELAS ---
@@ -609,31 +2032,19 @@ def gerar_tabela_diaria_empresa(df_vendas_filtrado):
         st.info("Nenhuma venda encontrada para gerar o relatório diário da empresa.")
         return pd.DataFrame()
 
-    df = df_vendas_filtrado.copy()
-
-    # CÓDIGO NOVO E CORRIGIDO
-    # Condição para OPD: Observação é OPD E status é F
-    cond_opd = (df['PED_OBS_INT'] == 'OPD') & (df['PED_STATUS'] == 'F')
-
-    # Condição para Distribuição: Observação é de distribuição E status é F ou N
-    cond_dist = df['PED_OBS_INT'].isin(['DISTRIBICAO', 'DISTRIBUICAO', 'DISTRIBUIÇÃO', 'LOJA']) & df['PED_STATUS'].isin(['F', 'N'])
-
-    # Aplicar as condições usando np.select para criar a coluna 'Tipo Venda'
-    df['Tipo Venda'] = np.select(
-        [cond_opd, cond_dist],    # Lista de condições a serem checadas
-        ['OPD', 'Distribuição'],  # Lista de valores correspondentes
-        default='Outros'          # Valor padrão se nenhuma condição for atendida
-    )
-    df_validos = df[df['Tipo Venda'].isin(['OPD', 'Distribuição'])]
+    # Pedidos ou células do cubo diário: 'Tipo Venda' já vem calculado (classificar_tipo_venda)
+    df_validos = df_vendas_filtrado[df_vendas_filtrado['Tipo Venda'] != 'Outros']
 
     tabela = pd.pivot_table(
         df_validos,
         values='PED_TOTAL',
-        index=df_validos['DAT_CAD'].dt.date,
+        index='DAT_CAD_DATE',
         columns='Tipo Venda',
         aggfunc=np.sum,
-        fill_value=0
+        fill_value=0,
+        observed=True
     )
+    tabela.columns = tabela.columns.astype(object)
 
     if 'OPD' not in tabela.columns:
         tabela['OPD'] = 0
@@ -659,22 +2070,8 @@ def gerar_tabela_geral(df_vendas_filtrado):
         st.info("Nenhuma venda encontrada para gerar o relatório geral.")
         return pd.DataFrame()
 
-    df = df_vendas_filtrado.copy()
-
-    # CÓDIGO NOVO E CORRIGIDO
-    # Condição para OPD: Observação é OPD E status é F
-    cond_opd = (df['PED_OBS_INT'] == 'OPD') & (df['PED_STATUS'] == 'F')
-
-    # Condição para Distribuição: Observação é de distribuição E status é F ou N
-    cond_dist = df['PED_OBS_INT'].isin(['DISTRIBICAO', 'DISTRIBUICAO', 'DISTRIBUIÇÃO', 'LOJA']) & df['PED_STATUS'].isin(['F', 'N'])
-
-    # Aplicar as condições usando np.select para criar a coluna 'Tipo Venda'
-    df['Tipo Venda'] = np.select(
-        [cond_opd, cond_dist],    # Lista de condições a serem checadas
-        ['OPD', 'Distribuição'],  # Lista de valores correspondentes
-        default='Outros'          # Valor padrão se nenhuma condição for atendida
-    )
-    df_validos = df[df['Tipo Venda'].isin(['OPD', 'Distribuição'])]
+    # Pedidos ou células do cubo diário: 'Tipo Venda' já vem calculado (classificar_tipo_venda)
+    df_validos = df_vendas_filtrado[df_vendas_filtrado['Tipo Venda'] != 'Outros']
 
     tabela = pd.pivot_table(
         df_validos,
@@ -682,8 +2079,10 @@ def gerar_tabela_geral(df_vendas_filtrado):
         index='VEN_NOME',
         columns='Tipo Venda',
         aggfunc=np.sum,
-        fill_value=0
+        fill_value=0,
+        observed=True
     )
+    tabela.columns = tabela.columns.astype(object)
 
     if 'OPD' not in tabela.columns:
         tabela['OPD'] = 0
@@ -707,22 +2106,8 @@ def gerar_tabela_vendedor(df_vendas_filtrado):
         st.info("Nenhuma venda encontrada para este vendedor no período.")
         return pd.DataFrame(), {}
 
-    df = df_vendas_filtrado.copy()
-
-    # CÓDIGO NOVO E CORRIGIDO
-    # Condição para OPD: Observação é OPD E status é F
-    cond_opd = (df['PED_OBS_INT'] == 'OPD') & (df['PED_STATUS'] == 'F')
-
-    # Condição para Distribuição: Observação é de distribuição E status é F ou N
-    cond_dist = df['PED_OBS_INT'].isin(['DISTRIBICAO', 'DISTRIBUICAO', 'DISTRIBUIÇÃO', 'LOJA']) & df['PED_STATUS'].isin(['F', 'N'])
-
-    # Aplicar as condições usando np.select para criar a coluna 'Tipo Venda'
-    df['Tipo Venda'] = np.select(
-        [cond_opd, cond_dist],    # Lista de condições a serem checadas
-        ['OPD', 'Distribuição'],  # Lista de valores correspondentes
-        default='Outros'          # Valor padrão se nenhuma condição for atendida
-    )
-    df_validos = df[df['Tipo Venda'].isin(['OPD', 'Distribuição'])]
+    # 'Tipo Venda' já vem calculado na base (classificar_tipo_venda): sem cópia nem np.select aqui
+    df_validos = df_vendas_filtrado[df_vendas_filtrado['Tipo Venda'] != 'Outros']
 
     total_opd = df_validos[df_validos['Tipo Venda'] == 'OPD']['PED_TOTAL'].sum()
     total_dist = df_validos[df_validos['Tipo Venda'] == 'Distribuição']['PED_TOTAL'].sum()
@@ -738,7 +2123,7 @@ def gerar_tabela_vendedor(df_vendas_filtrado):
         'CLI_RAZ',
         'PED_TOTAL',
         'Tipo Venda'
-    ]].copy()
+    ]]
 
     tabela.rename(columns={
         'VEN_NOME': 'Vendedor',
@@ -746,7 +2131,7 @@ def gerar_tabela_vendedor(df_vendas_filtrado):
         'PED_TOTAL': 'Valor',
     }, inplace=True)
 
-    tabela = tabela.sort_values(by='DAT_CAD', ascending=True)
+    tabela = tabela.sort_values(by='DAT_CAD', ascending=True, kind='stable')
     tabela['Data'] = tabela['DAT_CAD'].dt.strftime('%d/%m/%Y')
     tabela['Valor'] = tabela['Valor'].apply(lambda x: f"R$ {x:,.2f}")
 
@@ -766,21 +2151,8 @@ def gerar_dados_ranking(df_vendas_filtrado):
     if df_vendas_filtrado is None or df_vendas_filtrado.empty:
         return pd.DataFrame()
 
-    df = df_vendas_filtrado.copy()
-    # CÓDIGO NOVO E CORRIGIDO
-    # Condição para OPD: Observação é OPD E status é F
-    cond_opd = (df['PED_OBS_INT'] == 'OPD') & (df['PED_STATUS'] == 'F')
-
-    # Condição para Distribuição: Observação é de distribuição E status é F ou N
-    cond_dist = df['PED_OBS_INT'].isin(['DISTRIBICAO', 'DISTRIBUICAO', 'DISTRIBUIÇÃO', 'LOJA']) & df['PED_STATUS'].isin(['F', 'N'])
-
-    # Aplicar as condições usando np.select para criar a coluna 'Tipo Venda'
-    df['Tipo Venda'] = np.select(
-        [cond_opd, cond_dist],    # Lista de condições a serem checadas
-        ['OPD', 'Distribuição'],  # Lista de valores correspondentes
-        default='Outros'          # Valor padrão se nenhuma condição for atendida
-    )
-    df_validos = df[df['Tipo Venda'].isin(['OPD', 'Distribuição'])]
+    # Pedidos ou células do cubo diário: 'Tipo Venda' já vem calculado (classificar_tipo_venda)
+    df_validos = df_vendas_filtrado[df_vendas_filtrado['Tipo Venda'] != 'Outros']
 
     tabela = pd.pivot_table(
         df_validos,
@@ -788,8 +2160,10 @@ def gerar_dados_ranking(df_vendas_filtrado):
         index='VEN_NOME',
         columns='Tipo Venda',
         aggfunc='sum',
-        fill_value=0
+        fill_value=0,
+        observed=True
     )
+    tabela.columns = tabela.columns.astype(object)
 
     if 'OPD' not in tabela.columns: tabela['OPD'] = 0
     if 'Distribuição' not in tabela.columns: tabela['Distribuição'] = 0
@@ -797,6 +2171,326 @@ def gerar_dados_ranking(df_vendas_filtrado):
     return tabela.reset_index().rename(columns={'VEN_NOME': 'Vendedor'})
 
 
+# --- RESULTADOS DERIVADOS COMPARTILHADOS (COM TETO DE MEMÓRIA) ---
+
+# Teto de memória para resultados derivados (recortes filtrados etc.) mantidos
+# entre sessões. Ajustável pela variável de ambiente CRM_LIMITE_MEMORIA_MB.
+LIMITE_MEMORIA_DERIVADOS_MB = float(os.environ.get("CRM_LIMITE_MEMORIA_MB", "256"))
+
+
+@st.cache_resource(show_spinner=False)
+def obter_repositorio_derivados():
+    """
+    Repositório único por processo: chave -> (valor, tamanho em bytes), em ordem LRU.
+    """
+    return {"itens": OrderedDict(), "bytes": 0, "trava": threading.Lock(), "calculando": {}}
+
+
+def _tamanho_em_bytes(valor):
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamanho_em_bytes(v) for v in valor)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(_tamanho_em_bytes(v) for v in valor.values())
+    return sys.getsizeof(valor)
+
+
+def guardar_derivado(chave, valor):
+    """
+    Guarda um resultado derivado no repositório compartilhado e descarta os menos
+    usados recentemente até caber no teto LIMITE_MEMORIA_DERIVADOS_MB.
+    Retorna o próprio valor, para uso encadeado.
+    """
+    if valor is None:
+        return valor
+    repositorio = obter_repositorio_derivados()
+    limite = int(LIMITE_MEMORIA_DERIVADOS_MB * 1024 * 1024)
+    tamanho = _tamanho_em_bytes(valor)
+    with repositorio["trava"]:
+        itens = repositorio["itens"]
+        if chave in itens:
+            repositorio["bytes"] -= itens.pop(chave)[1]
+        if tamanho > limite:
+            return valor
+        itens[chave] = (valor, tamanho)
+        repositorio["bytes"] += tamanho
+        while repositorio["bytes"] > limite:
+            _, (_, tamanho_removido) = itens.popitem(last=False)
+            repositorio["bytes"] -= tamanho_removido
+    return valor
+
+
+def buscar_derivado(chave):
+    repositorio = obter_repositorio_derivados()
+    with repositorio["trava"]:
+        item = repositorio["itens"].get(chave)
+        if item is None:
+            return None
+        repositorio["itens"].move_to_end(chave)
+        return item[0]
+
+
+# --- CONSULTAS MEMORIZADAS DO PAINEL ---
+
+# Durante o cálculo de uma consulta memorizada, os avisos são guardados no
+# resultado em vez de exibidos, para que toda sessão que o reutilize os veja.
+_coleta_avisos = threading.local()
+
+
+def avisar(mensagem, nivel="warning", barra_lateral=False):
+    """
+    Exibe uma mensagem (st.warning, st.error, ...) ou, se houver uma coleta
+    ativa nesta thread, guarda-a para exibição posterior (exibir_avisos).
+    """
+    coleta = getattr(_coleta_avisos, "lista", None)
+    if coleta is not None:
+        coleta.append((nivel, mensagem, barra_lateral))
+        return
+    getattr(st.sidebar if barra_lateral else st, nivel)(mensagem)
+
+
+def exibir_avisos(avisos):
+    for nivel, mensagem, barra_lateral in avisos:
+        getattr(st.sidebar if barra_lateral else st, nivel)(mensagem)
+
+
+def memorizar(chave, calcular):
+    """
+    Resultado de calcular() guardado no repositório compartilhado sob `chave`.
+    Sessões que pedem a mesma chave ao mesmo tempo esperam um único cálculo
+    em vez de repeti-lo.
+    """
+    valor = buscar_derivado(chave)
+    if valor is not None:
+        return valor
+    repositorio = obter_repositorio_derivados()
+    with repositorio["trava"]:
+        trava_chave = repositorio["calculando"].setdefault(chave, threading.Lock())
+    try:
+        with trava_chave:
+            valor = buscar_derivado(chave)
+            if valor is None:
+                valor = guardar_derivado(chave, calcular())
+    finally:
+        with repositorio["trava"]:
+            repositorio["calculando"].pop(chave, None)
+    return valor
+
+
+def _versao_arquivo(caminho_arquivo):
+    try:
+        return impressao_digital(caminho_arquivo)
+    except FileNotFoundError:
+        return None
+
+
+def montar_consulta_painel(
+    arquivo_vendas,
+    mes_referencia,
+    vendedor_selecionado,
+    data_inicial,
+    data_final,
+    com_cdp,
+    ano_referencia,
+    caminho_metas,
+    aba_meta,
+    mes_metas
+):
+    """
+    Chave de uma consulta do painel: os filtros da barra lateral (na ordem dos
+    argumentos de filtrar_vendas), a aba e o mês das metas e a versão dos
+    arquivos de vendas e de metas.
+    """
+    return (
+        arquivo_vendas,
+        mes_referencia,
+        vendedor_selecionado,
+        data_inicial,
+        data_final,
+        com_cdp,
+        ano_referencia,
+        caminho_metas,
+        aba_meta,
+        mes_metas,
+        _versao_arquivo(arquivo_vendas),
+        _versao_arquivo(caminho_metas),
+    )
+
+
+def calcular_painel(consulta):
+    """
+    Recorte de vendas, totais OPD/Distribuição e comparação com as metas de
+    uma consulta (montar_consulta_painel), com os avisos gerados no caminho.
+    """
+    caminho_metas, aba_meta, mes_metas = consulta[7:10]
+    filtros = consulta[:7]
+    avisos = []
+    _coleta_avisos.lista = avisos
+    try:
+        df_filtrado = filtrar_vendas(*filtros)
+
+        matriz_metas = None
+        try:
+            matriz_metas = obter_matriz_metas(caminho_metas)
+            if aba_meta not in matriz_metas["indice_aba"]:
+                avisar(f"❌ Erro: A aba '{aba_meta}' não foi encontrada no arquivo de metas. Verifique o nome da aba.", "error")
+                matriz_metas = None
+            elif aba_meta in matriz_metas["abas_vazias"]:
+                avisar(f"⚠️ Planilha de metas para aba '{aba_meta}' está vazia.", barra_lateral=True)
+                matriz_metas = None
+        except FileNotFoundError:
+            avisar(f"❌ Erro: Arquivo de Metas '{caminho_metas}' não encontrado.", "error")
+        except Exception as e:
+            avisar(f"❌ Erro desconhecido ao carregar a planilha de metas: {e}", "error")
+
+        if df_filtrado is not None and not df_filtrado.empty:
+            # Totais a partir das células do cubo diário, sem reagregar os pedidos
+            total_opd, total_amc = processar_vendas(filtrar_cubo(*filtros))
+        else:
+            total_opd, total_amc = 0.0, 0.0
+
+        comparacao = {}
+        if matriz_metas is not None and mes_metas:
+            comparacao = comparar_com_metas(matriz_metas, aba_meta, mes_metas, total_opd, total_amc)
+            if not comparacao :
+                avisar(f"⚠️ Não foi possível gerar a comparação de metas para a aba '{aba_meta}' e mês {mes_metas}. Verifique se as categorias de meta existem nessa aba.", barra_lateral=True)
+        elif matriz_metas is None:
+            avisar(f"Metas não puderam ser carregadas da aba '{aba_meta}'. A comparação não será feita.", "error", barra_lateral=True)
+    finally:
+        _coleta_avisos.lista = None
+
+    return {
+        "df_filtrado": df_filtrado,
+        "total_opd": total_opd,
+        "total_amc": total_amc,
+        "comparacao": comparacao,
+        "avisos": avisos,
+    }
+
+
+def obter_painel(consulta):
+    """
+    Resultado memorizado de uma consulta do painel, compartilhado por todas as
+    sessões: gestores olhando "Todos / mês atual" ao mesmo tempo reutilizam o
+    mesmo recorte e os mesmos totais. Se tiver sido descartado pelo teto de
+    memória, é recalculado.
+    """
+    return memorizar(consulta, lambda: calcular_painel(consulta))
+
+
+# --- MONITOR DE ARQUIVOS (PRÉ-AQUECIMENTO DOS CACHES) ---
+
+PASTA_RECURSOS = "resources"
+# Caminhos usados pela interface: os caches em memória são indexados por essa
+# string, então o monitor pré-aquece exatamente as mesmas chaves
+ARQUIVO_VENDAS = "resources/VENDAS.xlsx"
+ARQUIVO_METAS = "resources/META.xlsx"
+ARQUIVO_FINANCEIRO = "resources/GERAL.xlsx"
+ATRASO_PREAQUECIMENTO = 2.0  # segundos sem novos eventos antes de recarregar um arquivo
+
+
+def _aquecer_vendas(caminho_arquivo):
+    # Lista de vendedores, anos, cubo, KPIs e a base/índice do ano mais recente (o mais consultado)
+    listar_vendedores(caminho_arquivo)
+    anos = listar_anos_vendas(caminho_arquivo)
+    obter_cubo_vendas(caminho_arquivo)
+    sincronizar_estado_kpis(caminho_arquivo)
+    if anos:
+        obter_indice_vendedores(caminho_arquivo, anos[-1])
+
+
+def _aquecer_feriados(caminho_arquivo):
+    carregar_feriados()
+
+
+def _aquecer_financeiro(caminho_arquivo):
+    _carregar_dados_financeiros_memoria(caminho_arquivo, *impressao_digital(caminho_arquivo))
+
+
+# Arquivo monitorado (mesmo caminho da interface) -> funções que reconstroem seus caches (e agregados padrão)
+AQUECEDORES = {
+    ARQUIVO_VENDAS: [_aquecer_vendas],
+    ARQUIVO_METAS: [obter_matriz_metas],
+    ARQUIVO_FINANCEIRO: [_aquecer_financeiro],
+}
+# Qualquer camada de feriados alterada reconstrói o registro combinado
+AQUECEDORES.update({caminho: [_aquecer_feriados] for caminho in CAMADAS_FERIADOS.values()})
+
+
+def preaquecer_caches(caminho_arquivo):
+    """
+    Reconstrói, fora do fluxo de uma requisição, os caches ligados a um arquivo
+    de resources/. Como os caches são indexados pela impressão digital do arquivo,
+    a próxima requisição já encontra a versão nova pronta em memória.
+    """
+    for aquecer in AQUECEDORES.get(caminho_arquivo, []):
+        try:
+            aquecer(caminho_arquivo)
+        except Exception as e:
+            # Arquivo ainda sendo copiado, por exemplo: a requisição seguinte tenta de novo
+            print(f"⚠️ Falha ao pré-aquecer cache de '{caminho_arquivo}': {e}")
+
+
+@st.cache_resource(show_spinner=False)
+def iniciar_monitor_recursos(pasta=PASTA_RECURSOS):
+    """
+    Inicia (uma única vez por processo) um observador watchdog sobre resources/.
+    Cada arquivo monitorado que for substituído é recarregado em segundo plano,
+    após ATRASO_PREAQUECIMENTO segundos sem novos eventos.
+    """
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        print("⚠️ watchdog não instalado: caches serão recarregados sob demanda.")
+        return None
+    if not os.path.isdir(pasta):
+        print(f"⚠️ Pasta '{pasta}' não encontrada: caches serão recarregados sob demanda.")
+        return None
+
+    # Nome do arquivo no evento -> caminho usado pela interface (chave dos caches)
+    monitorados = {
+        os.path.basename(caminho): caminho
+        for caminho in AQUECEDORES
+        if os.path.normpath(os.path.dirname(caminho)) == os.path.normpath(pasta)
+    }
+    temporizadores = {}
+    trava = threading.Lock()
+
+    def agendar(caminho):
+        nome = os.path.basename(caminho)
+        if nome not in monitorados:
+            return
+        caminho = monitorados[nome]
+        with trava:
+            anterior = temporizadores.get(nome)
+            if anterior is not None:
+                anterior.cancel()
+            temporizador = threading.Timer(ATRASO_PREAQUECIMENTO, preaquecer_caches, args=(caminho,))
+            temporizador.daemon = True
+            temporizadores[nome] = temporizador
+            temporizador.start()
+
+    class MonitorRecursos(FileSystemEventHandler):
+        def on_created(self, event):
+            agendar(event.src_path)
+
+        def on_modified(self, event):
+            agendar(event.src_path)
+
+        def on_moved(self, event):
+            agendar(event.dest_path)
+
+    observador = Observer()
+    observador.daemon = True
+    observador.schedule(MonitorRecursos(), pasta, recursive=False)
+    observador.start()
+    return observador
+
+
 # --- INTERFACE STREAMLIT ---
 
 # Onde você tem o st.sidebar.radio
@@ -809,15 +2503,17 @@ pagina_selecionada = st.sidebar.radio(
 
 st.title(f"📈 {pagina_selecionada}")
 
-caminho_metas = "resources/META.xlsx"
-caminho_vendas_padrao = "resources/VENDAS.xlsx"
+caminho_metas = ARQUIVO_METAS
+caminho_vendas_padrao = ARQUIVO_VENDAS
 uploaded_file = caminho_vendas_padrao
 feriados = carregar_feriados()
+iniciar_monitor_recursos()
 
 st.sidebar.header("Filtros")
 filtro_tipo = st.sidebar.radio("🔍 Tipo de filtro:", ["Mês", "Período Personalizado"])
 
 mes_selecionado = None
+ano_selecionado = datetime.date.today().year
 data_inicial, data_final = None, None
 
 if filtro_tipo == "Mês":
@@ -826,12 +2522,18 @@ if filtro_tipo == "Mês":
         format_func=lambda x: ["Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", "Julho", "Agosto", "Setembro", "Outubro", "Novembro", "Dezembro"][x - 1],
         index=datetime.date.today().month - 1
     )
-    ano_atual = datetime.date.today().year
-    data_inicial = datetime.date(ano_atual, mes_selecionado, 1)
+    # Anos com vendas na base (partições em disco), mais o ano atual
+    try:
+        anos_disponiveis = listar_anos_vendas(uploaded_file)
+    except FileNotFoundError:
+        anos_disponiveis = []
+    opcoes_ano = sorted(set(anos_disponiveis) | {ano_selecionado}, reverse=True)
+    ano_selecionado = st.sidebar.selectbox("📆 Ano de referência", opcoes_ano, index=opcoes_ano.index(ano_selecionado))
+    data_inicial = datetime.date(ano_selecionado, mes_selecionado, 1)
     if mes_selecionado == 12:
-        data_final = datetime.date(ano_atual, 12, 31)
+        data_final = datetime.date(ano_selecionado, 12, 31)
     else:
-        data_final = datetime.date(ano_atual, mes_selecionado + 1, 1) - datetime.timedelta(days=1)
+        data_final = datetime.date(ano_selecionado, mes_selecionado + 1, 1) - datetime.timedelta(days=1)
     st.sidebar.info(f"Período: {data_inicial.strftime('%d/%m/%Y')} a {data_final.strftime('%d/%m/%Y')}")
 else: # Período Personalizado
     data_intervalo = st.sidebar.date_input(
@@ -844,6 +2546,7 @@ else: # Período Personalizado
             st.sidebar.error("⚠️ A data inicial não pode ser maior que a data final!")
             st.stop()
         mes_selecionado = data_final.month
+        ano_selecionado = data_final.year
     else:
         st.sidebar.error("⚠️ Selecione uma data inicial e uma data final!")
         st.stop()
@@ -852,56 +2555,16 @@ vendedor_selecionado = "Todos"
 
 if pagina_selecionada != "Relatórios Financeiros":
     try:
-        df_vendas_bruto = pd.read_excel(uploaded_file)
-        vendedores_unicos_stripped = sorted(list(df_vendas_bruto["VEN_NOME"].dropna().str.strip().unique()))
-        vendedores = ["Todos"] + vendedores_unicos_stripped
+        vendedores = ["Todos"] + listar_vendedores(uploaded_file)
         vendedor_selecionado = st.sidebar.selectbox("👤 Vendedor", vendedores)
     except FileNotFoundError:
         st.error(f"❌ Erro: Arquivo '{uploaded_file}' não encontrado. Verifique o caminho.")
         st.stop()
 
-vendedor_selecionado_upper = vendedor_selecionado.upper()
-
-
 com_cdp = st.sidebar.checkbox("Incluir vendas da Casa do Pedreiro", value=True)
 
 # --- Seleção da Aba de Metas ---
-# As listas como rose_loja devem conter os nomes EXATOS e LIMPOS (e em MAIÚSCULAS para a comparação abaixo)
-rose_loja = ["ROSESILVESTRE"]
-paola_loja = ["PAOLA"]
-jemine_loja = ["JEMINE OLIVEIRA"]
-danilima_d = ["DANILIMA"]
-renato_d = ["JOSE RENATO MAULER"] # Assumindo que este também é o formato esperado em MAIÚSCULAS
-
-# 'vendedor_selecionado' já deve vir limpo do selectbox (sem espaços extras)
-# MODIFICAÇÃO APLICADA AQUI:
-vendedor_selecionado_upper = vendedor_selecionado.upper() # Converte para maiúsculas para comparação
-
-
-####################################################################################################
-if vendedor_selecionado == "Todos": # "Todos" é um valor especial, não precisa de .upper()
-    aba_meta_calculada = "GERAL"
-
-elif vendedor_selecionado_upper in paola_loja:
-    aba_meta_calculada = "PAOLA"
-
-elif vendedor_selecionado_upper in jemine_loja:
-    aba_meta_calculada = "JEMINE"
-
-elif vendedor_selecionado_upper in danilima_d:
-    aba_meta_calculada = "DANILIMA"
-
-elif vendedor_selecionado_upper in renato_d:
-    aba_meta_calculada = "RENATO"
-
-elif vendedor_selecionado_upper in rose_loja: # Compara "NOMEEMMAIUSCULAS" com ["ROSESILVESTRE"]
-    aba_meta_calculada = "ROSE"
-
-else:
-    aba_meta_calculada = "GERAL"
-
-# --- Fim da Seleção da Aba de Metas ---
-######################################################################################################
+aba_meta_calculada = aba_meta_do_vendedor(vendedor_selecionado)
 
 
 if st.sidebar.button("🔄 Processar Dados"):
@@ -909,67 +2572,58 @@ if st.sidebar.button("🔄 Processar Dados"):
         # st.sidebar.info(f"Vendedor selecionado (original): {vendedor_selecionado}")
         # st.sidebar.info(f"Tentando carregar metas da aba: '{aba_meta_calculada}'")
 
-        df_filtrado = filtrar_vendas(
+        consulta_painel = montar_consulta_painel(
             uploaded_file,
             mes_selecionado if filtro_tipo == "Mês" else None,
             vendedor_selecionado,
             data_inicial,
             data_final,
-            com_cdp
+            com_cdp,
+            ano_selecionado if filtro_tipo == "Mês" else None,
+            caminho_metas,
+            aba_meta_calculada,
+            mes_selecionado,
         )
+        resultado_painel = obter_painel(consulta_painel)
+        exibir_avisos(resultado_painel["avisos"])
 
-        planilha_metas = None
-        try:
-            planilha_metas = carregar_planilha_metas(caminho_metas, aba=aba_meta_calculada)
-            if planilha_metas.empty:
-                st.sidebar.warning(f"⚠️ Planilha de metas para aba '{aba_meta_calculada}' está vazia.")
-                planilha_metas = None
-        except FileNotFoundError:
-            st.error(f"❌ Erro: Arquivo de Metas '{caminho_metas}' não encontrado.")
-        except ValueError as ve:
-            if "Worksheet" in str(ve) and "not found" in str(ve):
-                st.error(f"❌ Erro: A aba '{aba_meta_calculada}' não foi encontrada no arquivo de metas. Verifique o nome da aba.")
-            else:
-                st.error(f"❌ Erro ao carregar planilha de metas: {ve}")
-        except Exception as e:
-            st.error(f"❌ Erro desconhecido ao carregar a aba '{aba_meta_calculada}' da planilha de metas: {e}")
-
-        if df_filtrado is not None and not df_filtrado.empty:
-            total_opd, total_amc = processar_vendas(df_filtrado)
-        else:
-            total_opd, total_amc = 0.0, 0.0
-
-        comparacao = {}
-        if planilha_metas is not None and mes_selecionado:
-            comparacao = comparar_com_metas(planilha_metas, mes_selecionado, total_opd, total_amc)
-            if not comparacao :
-                st.sidebar.warning(f"⚠️ Não foi possível gerar a comparação de metas para a aba '{aba_meta_calculada}' e mês {mes_selecionado}. Verifique se as categorias de meta existem nessa aba.")
-        elif planilha_metas is None:
-            st.sidebar.error(f"Metas não puderam ser carregadas da aba '{aba_meta_calculada}'. A comparação não será feita.")
-
-        st.session_state['df_filtrado'] = df_filtrado
-        st.session_state['total_opd'] = total_opd
-        st.session_state['total_amc'] = total_amc
-        st.session_state['comparacao'] = comparacao
+        # A sessão guarda só a consulta; o resultado fica no repositório compartilhado
+        st.session_state['consulta_painel'] = consulta_painel
         st.session_state['mes_selecionado'] = mes_selecionado
+        st.session_state['ano_selecionado'] = ano_selecionado
         st.session_state['feriados'] = feriados
         st.session_state['vendedor_selecionado'] = vendedor_selecionado
         st.session_state['aba_meta_usada'] = aba_meta_calculada
 
 
-if 'df_filtrado' not in st.session_state:
+if 'consulta_painel' not in st.session_state:
     st.info("📂 Selecione os filtros na barra lateral e clique em 'Processar Dados'.")
 else:
-    df_filtrado = st.session_state['df_filtrado']
-    total_opd = st.session_state['total_opd']
-    total_amc = st.session_state['total_amc']
-    comparacao = st.session_state['comparacao']
+    resultado_painel = obter_painel(st.session_state['consulta_painel'])
+    df_filtrado = resultado_painel['df_filtrado']
+    cubo_filtrado = filtrar_cubo(*st.session_state['consulta_painel'][:7])
+    total_opd = resultado_painel['total_opd']
+    total_amc = resultado_painel['total_amc']
+    comparacao = resultado_painel['comparacao']
     mes = st.session_state['mes_selecionado']
+    ano_sess = st.session_state.get('ano_selecionado')
     feriados_sess = st.session_state['feriados'] # Renomeado para evitar conflito com a variável global
     vendedor_selecionado_sess = st.session_state['vendedor_selecionado'] # Renomeado
 
+    # Filtro por mês: totais da Visão Geral vindos do estado incremental dos KPIs,
+    # que absorve pedidos novos sem refazer o recorte da base (tendência ao vivo)
+    consulta_sess = st.session_state['consulta_painel']
+    try:
+        estado_kpis = sincronizar_estado_kpis(consulta_sess[0])
+    except FileNotFoundError:
+        estado_kpis = None
+    if estado_kpis is not None and consulta_sess[1] is not None:
+        total_opd, total_amc = realizado_kpis(estado_kpis, ano_sess, mes, vendedor_selecionado_sess, consulta_sess[5])
+        realizados = {"OPD": total_opd, "AMC": total_amc}
+        comparacao = {categoria: {**metas_cat, "Realizado": realizados[categoria]} for categoria, metas_cat in comparacao.items()}
+
     if pagina_selecionada == "Painel de Vendas":
-        tab1, tab2, tab3 = st.tabs(["📊 Visão Geral", "📋 Relatórios Detalhados", "🔮 Previsão de Vendas (Em Teste)"])
+        tab1, tab_placar, tab2, tab3 = st.tabs(["📊 Visão Geral", "🏆 Placar da Equipe", "📋 Relatórios Detalhados", "🔮 Previsão de Vendas (Em Teste)"])
         with tab1:
             if df_filtrado is None or df_filtrado.empty:
                 st.warning("Nenhum dado para exibir no Painel Principal com os filtros atuais.")
@@ -981,25 +2635,13 @@ else:
                 with col2:
                     st.metric("📊 Vendas Distribuição", f"R$ {total_amc:,.2f}")
             else:
-                dias_uteis_passados = calcular_dias_uteis_passados(mes, incluir_hoje=False, feriados=feriados_sess)
-                dias_uteis_restantes = calcular_dias_uteis_restantes(mes, incluir_hoje=True, feriados=feriados_sess)
-                # Evita divisão por zero se não houver dias passados/restantes no mês (ex: primeiro/último dia)
-                dias_uteis_passados_calc = max(1, dias_uteis_passados)
-                dias_uteis_restantes_calc = max(1, dias_uteis_restantes)
+                dias_uteis_passados = calcular_dias_uteis_passados(mes, incluir_hoje=False, feriados=feriados_sess, ano=ano_sess)
+                dias_uteis_restantes = calcular_dias_uteis_restantes(mes, incluir_hoje=True, feriados=feriados_sess, ano=ano_sess)
 
 
                 def format_valor(valor):
                     return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
-                def calcular_tendencia(realizado, dias_passados, dias_futuros):
-                    if dias_passados == 0: # Se não houve dias úteis passados no período filtrado
-                        media_diaria = 0
-                        tendencia_total = realizado # A tendência é apenas o que já foi realizado
-                    else:
-                        media_diaria = realizado / dias_passados
-                        tendencia_total = realizado + (media_diaria * dias_futuros)
-                    return tendencia_total, media_diaria
-
                 if vendedor_selecionado_sess == "Todos":
                     soma_total = total_opd + total_amc
                     realizado_geral = soma_total
@@ -1008,8 +2650,10 @@ else:
                     super_meta = comparacao.get("AMC", {}).get("Super Meta", 0) + comparacao.get("OPD", {}).get("Meta Desafio", 0)
 
                     def gerar_bloco_meta(titulo, meta_valor):
-                        tendencia, media_diaria = calcular_tendencia(realizado_geral, dias_uteis_passados_calc, dias_uteis_restantes_calc)
-                        necessario_por_dia = max(0, (meta_valor - realizado_geral) / dias_uteis_restantes_calc) if dias_uteis_restantes_calc > 0 else (meta_valor - realizado_geral)
+                        # Dias úteis passados/restantes contam no mínimo 1 (primeiro/último dia do mês)
+                        projecao = projetar_metas(realizado_geral, [meta_valor], dias_uteis_passados, dias_uteis_restantes)
+                        tendencia, media_diaria = projecao["tendencia"], projecao["media_diaria"]
+                        necessario_por_dia = projecao["necessario_dia"][0]
 
                         html = (
                             f"<div style='background-color:#161616; padding:10px; border-radius:10px; width:33%; text-align:center; margin-bottom:10px;'>"
@@ -1043,18 +2687,34 @@ else:
                         st.info("Dados de Distribuição (AMC) não disponíveis para o gráfico.")
 
 
+                # --- Ritmo do mês: realizado acumulado x trajetória de cada nível de meta ---
+                # (só no filtro por mês; no período personalizado não há um mês a acompanhar)
+                matriz_ritmo = None
+                if estado_kpis is not None and consulta_sess[1] is not None:
+                    try:
+                        matriz_ritmo = obter_matriz_metas(consulta_sess[7])
+                    except FileNotFoundError:
+                        pass  # planilha de metas removida depois da consulta: segue sem o gráfico
+                if matriz_ritmo is not None:
+                    vendas_por_dia = vendas_diarias_kpis(estado_kpis, ano_sess, mes, vendedor_selecionado_sess, consulta_sess[5]).sum(axis=0)
+                    metas_niveis = metas_por_nivel(matriz_ritmo, [consulta_sess[8]], consulta_sess[9])[0]
+                    ritmo = calcular_ritmo_metas(
+                        vendas_por_dia, dict(zip(NIVEIS_META, metas_niveis)), ano_sess, mes, obter_calendario_uteis(feriados_sess)
+                    )
+                    st.plotly_chart(gerar_grafico_ritmo(ritmo, f"📈 Ritmo do Mês ({mes:02d}/{ano_sess}): Realizado x Metas por Dias Úteis"), use_container_width=True)
+
                 st.markdown("<h2 style='text-align: center; margin-top: 30px;'>📢 Status Detalhado das Metas</h2>", unsafe_allow_html=True)
                 col1_m, col2_m = st.columns(2)
 
                 def exibir_metricas(coluna, titulo, metas_cat, realizado_cat):
                     with coluna:
                         st.markdown(f"<div style='text-align: center; font-size: 25px; font-weight: bold; margin-bottom: 15px;'>{titulo}</div>", unsafe_allow_html=True)
-                        tendencia, media_diaria = calcular_tendencia(realizado_cat, dias_uteis_passados_calc, dias_uteis_restantes_calc)
+                        projecao = projetar_metas(realizado_cat, list(metas_cat.values()), dias_uteis_passados, dias_uteis_restantes)
+                        tendencia, media_diaria = projecao["tendencia"], projecao["media_diaria"]
 
-                        for nome_meta, valor_meta in metas_cat.items():
+                        for (nome_meta, valor_meta), necessario in zip(metas_cat.items(), projecao["necessario_dia"]):
                             if nome_meta == "Realizado" or valor_meta <= 0: continue
 
-                            necessario = max(0, (valor_meta - realizado_cat) / dias_uteis_restantes_calc) if dias_uteis_restantes_calc > 0 else (valor_meta - realizado_cat)
                             delta_color = "normal" # Default to normal (red for negative delta in st.metric)
                             diferenca_tendencia_meta = tendencia - valor_meta
                             percentual_tendencia = (diferenca_tendencia_meta / valor_meta) * 100 if valor_meta > 0 else 0
@@ -1108,6 +2768,18 @@ else:
                     with col2_m:
                         st.info("Dados de metas Distribuição (AMC) não disponíveis.")
 
+        with tab_placar:
+            # Mês de referência da consulta, para a equipe inteira (independe do vendedor escolhido)
+            st.subheader(f"🏆 Placar da Equipe — {mes:02d}/{ano_sess}")
+            placar = gerar_placar_equipe(consulta_sess[0], consulta_sess[7], ano_sess, mes, consulta_sess[5], feriados_sess)
+            if not placar.empty:
+                colunas_valor = placar.columns.drop(["Vendedor", "Aba de Metas"])
+                st.dataframe(
+                    placar.style.format("R$ {:,.2f}", subset=colunas_valor, na_rep="-"),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
         with tab2:
             if df_filtrado is None or df_filtrado.empty:
                 st.warning("Nenhum dado para exibir nos Relatórios com os filtros atuais.")
@@ -1124,16 +2796,16 @@ else:
                         )
                         if tipo_visao_geral == "Resumo por Vendedor":
                             st.markdown("##### Total de Vendas por Vendedor")
-                            tabela_geral_df = gerar_tabela_geral(df_filtrado)
+                            tabela_geral_df = gerar_tabela_geral(cubo_filtrado)
                             st.dataframe(tabela_geral_df, use_container_width=True)
                         elif tipo_visao_geral == "Resumo Dia a Dia (Empresa)":
                             st.markdown("##### Vendas Resumidas da Empresa (Dia a Dia)")
-                            tabela_resumo_dia_df = gerar_tabela_diaria_empresa(df_filtrado)
+                            tabela_resumo_dia_df = gerar_tabela_diaria_empresa(cubo_filtrado)
                             st.dataframe(tabela_resumo_dia_df, use_container_width=True)
 
                         st.markdown("---")
                         st.subheader("🏆 Ranking de Vendedores no Período")
-                        df_ranking = gerar_dados_ranking(df_filtrado)
+                        df_ranking = gerar_dados_ranking(cubo_filtrado)
 
                         if not df_ranking.empty:
                             col1, col2 = st.columns(2)
@@ -1142,7 +2814,7 @@ else:
                                     with col:
                                         st.markdown(f"##### {tipo_rank}")
                                         df_sorted = df_ranking.sort_values(by=tipo_rank, ascending=False)
-                                        df_top3 = df_sorted.head(3).copy()
+                                        df_top3 = df_sorted.head(3)
                                         cores = ['#e02500', '#e93900', '#f35202']
                                         df_top3['Cor'] = cores[:len(df_top3)]
 
@@ -1212,11 +2884,9 @@ else:
                 st.warning("⚠️ Não há dados suficientes para gerar uma previsão.")
             else:
                 # --- Preparar os dados ---
-                df_forecast = df_filtrado.copy()
-                df_forecast = df_forecast[['DAT_CAD_DATE', 'PED_TOTAL']].rename(
+                df_forecast = df_filtrado[['DAT_CAD_DATE', 'PED_TOTAL']].rename(
                     columns={'DAT_CAD_DATE': 'ds', 'PED_TOTAL': 'y'}
                 )
-                df_forecast['ds'] = pd.to_datetime(df_forecast['ds'])
                 df_forecast = df_forecast.groupby('ds').sum().reset_index().sort_values('ds')
 
                 # --- Criar e treinar o modelo ---
@@ -1234,7 +2904,7 @@ else:
 
                 # --- KPIs principais ---
                 ultima_data = df_forecast['ds'].max()
-                previsao_futura = previsao[previsao['ds'] > ultima_data].copy()
+                previsao_futura = previsao[previsao['ds'] > ultima_data]
                 total_previsto = previsao_futura['yhat'].sum()
                 total_realizado = df_forecast['y'].sum()
 
@@ -1342,7 +3012,7 @@ else:
     # -------------------------------------------------------------------------------- 
     elif pagina_selecionada == "Painel Financeiro":
 
-        caminho_financeiro = "resources/GERAL.xlsx"
+        caminho_financeiro = ARQUIVO_FINANCEIRO
         df_receber, df_pagar = carregar_dados_financeiros(caminho_financeiro)
 
         if df_receber is not None and df_pagar is not None:
@@ -1444,8 +3114,8 @@ else:
                         aplicar_despesa = st.button("Aplicar Despesa")
 
                 # --- APLICAR SIMULAÇÕES ---
-                df_receber_simulado = df_receber.copy()
-                df_pagar_simulado = df_pagar.copy()
+                df_receber_simulado = df_receber
+                df_pagar_simulado = df_pagar
 
                 if aplicar_receita and sim_receita_valor > 0:
                     nova_receita = pd.DataFrame([{'Cliente': 'RECEITA SIMULADA', 'Data Vencimento': pd.to_datetime(sim_receita_data), 'Valor': sim_receita_valor, 'Status': 'EM ABERTO'}])
@@ -1592,7 +3262,7 @@ else:
                                             ]
 
                                             # 2. Filtrar apenas as despesas "EM ABERTO" do período
-                                            despesas_aberto = despesas_no_periodo[despesas_no_periodo['Status'] == 'PAGO'].copy()
+                                            despesas_aberto = despesas_no_periodo[despesas_no_periodo['Status'] == 'PAGO']
                                             # --- FIM DA CORREÇÃO ---
 
                                             if not despesas_aberto.empty:
@@ -1653,9 +3323,7 @@ else:
                     """
                 )
 
-                caminho_financeiro = "resources/GERAL.xlsx"
-                df_receber, df_pagar = carregar_dados_financeiros(caminho_financeiro)
-
+                # df_receber/df_pagar já foram carregados no início da página (cache compartilhado)
                 df_resultados = pd.DataFrame()
 
                 # --- REGIME DE COMPETÊNCIA ---
@@ -1676,9 +3344,6 @@ else:
                 elif tipo_analise == 'Regime Realizado':
                     st.markdown("Compare suas **receitas efetivamente recebidas** com suas **despesas efetivamente pagas**.")
                     if df_receber is not None and df_pagar is not None:
-                        df_receber['Data_Baixa'] = pd.to_datetime(df_receber['Data_Baixa'], errors='coerce')
-                        df_pagar['Data_Baixa'] = pd.to_datetime(df_pagar['Data_Baixa'], errors='coerce')
-
                         df_recebimentos = df_receber[df_receber['Status'] == 'PAGO'].dropna(subset=['Data_Baixa'])
                         df_pagamentos = df_pagar[df_pagar['Status'] == 'PAGO'].dropna(subset=['Data_Baixa'])
 
@@ -0,0 +1,76 @@
+"""
+Pico de memória por renderização do painel, medido com tracemalloc enquanto o
+main.py roda pelo AppTest do Streamlit (sem alterações no app).
+
+Com copy-on-write, os geradores de relatório trabalham sobre visões das bases
+em cache: uma renderização não pode alocar mais que um múltiplo fixo do
+tamanho das planilhas de entrada.
+"""
+import os
+import shutil
+import tracemalloc
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Pico aceito por renderização, em múltiplos do tamanho das planilhas de entrada
+MULTIPLO_MAXIMO = 30
+# Filtro com vendas em resources/VENDAS.xlsx (o padrão, mês atual, cai no painel vazio)
+MES_REFERENCIA, ANO_REFERENCIA = 6, 2025
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # Cópia isolada: o cache em disco (.cache) é criado fora do repositório
+    shutil.copy(os.path.join(RAIZ, "main.py"), tmp_path)
+    shutil.copytree(os.path.join(RAIZ, "resources"), tmp_path / "resources")
+    shutil.copytree(os.path.join(RAIZ, "assets"), tmp_path / "assets")
+    monkeypatch.chdir(tmp_path)
+    return AppTest.from_file(str(tmp_path / "main.py"), default_timeout=300)
+
+
+def _tamanho_entrada():
+    pasta = "resources"
+    return sum(os.path.getsize(os.path.join(pasta, nome)) for nome in os.listdir(pasta) if nome.endswith(".xlsx"))
+
+
+def _pico_renderizacao(executar):
+    tracemalloc.start()
+    try:
+        executar()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _widget(app, tipo, rotulo):
+    return next(w for w in getattr(app, tipo) if w.label.startswith(rotulo))
+
+
+def _renderizou_painel(app):
+    return (
+        not app.exception
+        and len(app.metric) > 0
+        and len(app.dataframe) > 0
+        and not any("Nenhuma venda" in aviso.value for aviso in app.warning)
+    )
+
+
+@pytest.mark.parametrize("visualizacao", ["Painel de Vendas", "Painel Financeiro"])
+def test_pico_de_memoria_por_renderizacao(app, visualizacao):
+    app.run()
+    _widget(app, "radio", "Escolha a visualização").set_value(visualizacao).run()
+    # Mês com vendas na planilha de exemplo: os geradores de relatório precisam rodar
+    _widget(app, "selectbox", "📅").set_value(MES_REFERENCIA).run()
+    _widget(app, "selectbox", "📆").set_value(ANO_REFERENCIA).run()
+    # Primeira carga: lê as planilhas e preenche os caches (custo único, fora da medição)
+    _widget(app, "button", "🔄 Processar Dados").click().run()
+    assert _renderizou_painel(app)
+
+    limite = MULTIPLO_MAXIMO * _tamanho_entrada()
+    for _ in range(2):
+        pico = _pico_renderizacao(app.run)
+        assert _renderizou_painel(app)
+        assert pico < limite, f"pico de {pico / 2**20:.1f} MB por renderização (limite {limite / 2**20:.1f} MB)"